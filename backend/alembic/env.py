@@ -1,18 +1,14 @@
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config, pool
 from alembic import context
-import os
 import sys
 from pathlib import Path
-from dotenv import load_dotenv
 
 # Add project root to Python path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-# Load environment variables
-load_dotenv()
-
 # Import all models
+from app.config import settings
 from app.database import Base
 from app.models.base import (
     Organization,
@@ -22,12 +18,17 @@ from app.models.base import (
     Anomaly,
     SavingsReport
 )
+from app.models.aws_resources import (
+    AWSResource,
+    Recommendation,
+    CostSnapshot
+)
 
 # This is the Alembic Config object
 config = context.config
 
 # Override sqlalchemy.url with environment variable
-config.set_main_option("sqlalchemy.url", os.getenv("DATABASE_URL"))
+config.set_main_option("sqlalchemy.url", settings.database_url)
 
 # Interpret the config file for Python logging
 if config.config_file_name is not None:
@@ -37,6 +38,13 @@ if config.config_file_name is not None:
 target_metadata = Base.metadata
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    """Skip tables in the database that our models don't manage"""
+    if type_ == "table" and reflected and compare_to is None:
+        return False
+    return True
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode."""
     url = config.get_main_option("sqlalchemy.url")
@@ -47,6 +55,9 @@ def run_migrations_offline() -> None:
         dialect_opts={"paramstyle": "named"},
         compare_type=True,
         compare_server_default=True,
+        include_object=include_object,
+        include_schemas=False,
+        transaction_per_migration=True,
     )
 
     with context.begin_transaction():
@@ -67,6 +78,12 @@ def run_migrations_online() -> None:
             target_metadata=target_metadata,
             compare_type=True,
             compare_server_default=True,
+            include_object=include_object,
+            include_schemas=False,
+            # Commit each revision on its own so a failure doesn't roll
+            # back (and force re-running) every migration before it
+            transaction_per_migration=True,
+            render_as_batch=False,
         )
 
         with context.begin_transaction():
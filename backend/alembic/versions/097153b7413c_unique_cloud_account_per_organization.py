@@ -0,0 +1,55 @@
+"""Unique cloud account per organization
+
+Revision ID: 097153b7413c
+Revises: 1b50dceedcef
+Create Date: 2026-10-15 12:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '097153b7413c'
+down_revision: Union[str, None] = '1b50dceedcef'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Tables holding a cloud_account_id foreign key
+CHILD_TABLES = ('resources', 'anomalies', 'aws_resources', 'cost_snapshots')
+
+
+def upgrade() -> None:
+    # Merge existing duplicates first: keep the most recently created row of
+    # each (organization_id, account_id) pair (it holds the latest
+    # credentials), move the others' child rows onto it, then delete them
+    op.execute("""
+        CREATE TEMPORARY TABLE duplicate_cloud_accounts ON COMMIT DROP AS
+        SELECT id, keep_id FROM (
+            SELECT id, first_value(id) OVER (
+                PARTITION BY organization_id, account_id
+                ORDER BY created_at DESC, id DESC
+            ) AS keep_id
+            FROM cloud_accounts
+        ) ranked
+        WHERE id <> keep_id
+    """)
+    for table in CHILD_TABLES:
+        op.execute(f"""
+            UPDATE {table} SET cloud_account_id = d.keep_id
+            FROM duplicate_cloud_accounts d
+            WHERE {table}.cloud_account_id = d.id
+        """)
+    op.execute("""
+        DELETE FROM cloud_accounts
+        USING duplicate_cloud_accounts d
+        WHERE cloud_accounts.id = d.id
+    """)
+    
+    op.create_index('uq_cloud_accounts_org_account', 'cloud_accounts', ['organization_id', 'account_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('uq_cloud_accounts_org_account', table_name='cloud_accounts')
@@ -0,0 +1,36 @@
+"""Add recommendation and cost snapshot indexes for dashboard queries
+
+Revision ID: 1b50dceedcef
+Revises: 41d686a3044e
+Create Date: 2026-10-15 11:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b50dceedcef'
+down_revision: Union[str, None] = '41d686a3044e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY avoids locking writes on large tables, but can't run
+    # inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_rec_org_status_savings', 'recommendations',
+                        ['organization_id', 'status', sa.text('monthly_savings DESC')],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_cost_snapshots_org_date', 'cost_snapshots',
+                        ['organization_id', sa.text('snapshot_date DESC')],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_cost_snapshots_org_date', table_name='cost_snapshots', postgresql_concurrently=True)
+        op.drop_index('ix_rec_org_status_savings', table_name='recommendations', postgresql_concurrently=True)
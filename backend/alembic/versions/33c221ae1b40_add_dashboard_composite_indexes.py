@@ -0,0 +1,30 @@
+"""Add composite and partial indexes for dashboard queries
+
+Revision ID: 33c221ae1b40
+Revises: 479f47311823
+Create Date: 2026-10-15 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '33c221ae1b40'
+down_revision: Union[str, None] = '479f47311823'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_resources_acct_type_state', 'resources', ['cloud_account_id', 'resource_type', 'state'], unique=False)
+    op.create_index('ix_anomalies_open', 'anomalies', ['cloud_account_id', 'detected_at'], unique=False, postgresql_where=sa.text("status = 'ACTIVE'"))
+    op.create_index('ix_awsres_acct_type', 'aws_resources', ['cloud_account_id', 'resource_type'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_awsres_acct_type', table_name='aws_resources')
+    op.drop_index('ix_anomalies_open', table_name='anomalies')
+    op.drop_index('ix_resources_acct_type_state', table_name='resources')
@@ -0,0 +1,54 @@
+"""Switch JSON columns to JSONB and add GIN indexes on tags
+
+Revision ID: 41d686a3044e
+Revises: 6fa52870ec4d
+Create Date: 2026-10-15 09:45:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '41d686a3044e'
+down_revision: Union[str, None] = '6fa52870ec4d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+JSON_COLUMNS = {
+    'organizations': ['settings'],
+    'cloud_accounts': ['regions_enabled'],
+    'resources': ['tags', 'utilization_metrics', 'size_spec', 'resource_metadata'],
+    'anomalies': ['recommendation', 'evidence'],
+    'savings_reports': ['spend_by_service', 'savings_by_category', 'top_recommendations', 'report_data'],
+    'aws_resources': ['tags', 'specifications', 'metrics'],
+    'recommendations': ['action_steps'],
+    'cost_snapshots': ['service_costs', 'resource_counts'],
+}
+
+
+def upgrade() -> None:
+    for table, columns in JSON_COLUMNS.items():
+        for column in columns:
+            op.alter_column(table, column,
+                            existing_type=sa.JSON(),
+                            type_=postgresql.JSONB(),
+                            postgresql_using=f'{column}::jsonb')
+    
+    op.create_index('ix_resources_tags_gin', 'resources', ['tags'], unique=False, postgresql_using='gin')
+    op.create_index('ix_awsres_tags_gin', 'aws_resources', ['tags'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_awsres_tags_gin', table_name='aws_resources')
+    op.drop_index('ix_resources_tags_gin', table_name='resources')
+    
+    for table, columns in JSON_COLUMNS.items():
+        for column in columns:
+            op.alter_column(table, column,
+                            existing_type=postgresql.JSONB(),
+                            type_=sa.JSON(),
+                            postgresql_using=f'{column}::json')
@@ -19,12 +19,83 @@ depends_on: Union[str, Sequence[str], None] = None
 
 
 def upgrade() -> None:
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
+    # Databases deployed before this revision was filled in already got these
+    # tables from the app's startup create_all; only create what is missing
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    
+    if 'aws_resources' not in existing:
+        op.create_table('aws_resources',
+        sa.Column('id', sa.UUID(), nullable=False),
+        sa.Column('cloud_account_id', sa.UUID(), nullable=True),
+        sa.Column('resource_type', sa.String(), nullable=False),
+        sa.Column('resource_id', sa.String(), nullable=False),
+        sa.Column('resource_arn', sa.String(), nullable=True),
+        sa.Column('resource_name', sa.String(), nullable=True),
+        sa.Column('region', sa.String(), nullable=False),
+        sa.Column('availability_zone', sa.String(), nullable=True),
+        sa.Column('state', sa.String(), nullable=True),
+        sa.Column('created_time', sa.DateTime(), nullable=True),
+        sa.Column('hourly_cost', sa.Float(), nullable=True),
+        sa.Column('monthly_cost', sa.Float(), nullable=True),
+        sa.Column('tags', sa.JSON(), nullable=True),
+        sa.Column('specifications', sa.JSON(), nullable=True),
+        sa.Column('metrics', sa.JSON(), nullable=True),
+        sa.Column('first_seen', sa.DateTime(), nullable=True),
+        sa.Column('last_seen', sa.DateTime(), nullable=True),
+        sa.Column('last_analyzed', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['cloud_account_id'], ['cloud_accounts.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    
+    if 'recommendations' not in existing:
+        op.create_table('recommendations',
+        sa.Column('id', sa.UUID(), nullable=False),
+        sa.Column('resource_id', sa.UUID(), nullable=True),
+        sa.Column('organization_id', sa.UUID(), nullable=True),
+        sa.Column('recommendation_type', sa.String(), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('monthly_savings', sa.Float(), nullable=False),
+        sa.Column('annual_savings', sa.Float(), nullable=True),
+        sa.Column('implementation_cost', sa.Float(), nullable=True),
+        sa.Column('risk_level', sa.String(), nullable=True),
+        sa.Column('complexity', sa.String(), nullable=True),
+        sa.Column('confidence_score', sa.Float(), nullable=True),
+        sa.Column('action_steps', sa.JSON(), nullable=True),
+        sa.Column('automation_possible', sa.Boolean(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.Column('implemented_at', sa.DateTime(), nullable=True),
+        sa.Column('dismissed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ),
+        sa.ForeignKeyConstraint(['resource_id'], ['aws_resources.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    
+    if 'cost_snapshots' not in existing:
+        op.create_table('cost_snapshots',
+        sa.Column('id', sa.UUID(), nullable=False),
+        sa.Column('organization_id', sa.UUID(), nullable=True),
+        sa.Column('cloud_account_id', sa.UUID(), nullable=True),
+        sa.Column('snapshot_date', sa.DateTime(), nullable=False),
+        sa.Column('granularity', sa.String(), nullable=True),
+        sa.Column('total_cost', sa.Float(), nullable=False),
+        sa.Column('compute_cost', sa.Float(), nullable=True),
+        sa.Column('storage_cost', sa.Float(), nullable=True),
+        sa.Column('network_cost', sa.Float(), nullable=True),
+        sa.Column('database_cost', sa.Float(), nullable=True),
+        sa.Column('other_cost', sa.Float(), nullable=True),
+        sa.Column('service_costs', sa.JSON(), nullable=True),
+        sa.Column('resource_counts', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['cloud_account_id'], ['cloud_accounts.id'], ),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
 
 
 def downgrade() -> None:
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
+    op.drop_table('cost_snapshots')
+    op.drop_table('recommendations')
+    op.drop_table('aws_resources')
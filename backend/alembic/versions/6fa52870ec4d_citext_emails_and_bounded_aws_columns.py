@@ -0,0 +1,60 @@
+"""Use CITEXT for emails and bound AWS resource string columns
+
+Revision ID: 6fa52870ec4d
+Revises: 33c221ae1b40
+Create Date: 2026-10-15 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6fa52870ec4d'
+down_revision: Union[str, None] = '33c221ae1b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (column, new length) for aws_resources
+AWS_RESOURCE_COLUMNS = [
+    ('resource_type', 100),
+    ('resource_id', 255),
+    ('resource_arn', 512),
+    ('resource_name', 255),
+    ('region', 50),
+    ('availability_zone', 50),
+    ('state', 50),
+]
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS citext')
+    
+    for table in ('users', 'organizations'):
+        op.alter_column(table, 'email',
+                        existing_type=sa.String(length=255),
+                        type_=postgresql.CITEXT(),
+                        existing_nullable=False,
+                        postgresql_using='email::citext')
+    
+    for column, length in AWS_RESOURCE_COLUMNS:
+        op.alter_column('aws_resources', column,
+                        existing_type=sa.String(),
+                        type_=sa.String(length=length))
+
+
+def downgrade() -> None:
+    for column, _ in AWS_RESOURCE_COLUMNS:
+        op.alter_column('aws_resources', column,
+                        existing_type=sa.String(),
+                        type_=sa.String())
+    
+    for table in ('users', 'organizations'):
+        op.alter_column(table, 'email',
+                        existing_type=postgresql.CITEXT(),
+                        type_=sa.String(length=255),
+                        existing_nullable=False,
+                        postgresql_using='email::varchar(255)')
@@ -0,0 +1,178 @@
+"""
+Redis connection management
+
+One connection pool is shared by the whole API process so each Redis
+call reuses an open socket instead of opening a new connection.
+
+Also provides a small cache-aside helper for JSON responses. Redis
+errors never fail a request: the value is simply computed uncached.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+import orjson
+import redis
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = settings.redis_url
+
+# Shared connection pool and client
+redis_pool = aioredis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=settings.redis_max_connections
+)
+redis_client = aioredis.Redis(connection_pool=redis_pool)
+
+# Synchronous client for Celery tasks (connects lazily on first use)
+sync_redis_client = redis.Redis.from_url(REDIS_URL)
+
+# Cache key prefixes, scoped per organization
+DASHBOARD_KEY = "v1:dashboard:{org_id}"
+RECOMMENDATIONS_KEY = "v1:recs:{org_id}:{limit}"
+
+# AWS credential checks, keyed by a fingerprint of the credentials
+CONNECTION_TEST_KEY = "v1:aws:connection-test:{fingerprint}"
+CONNECTION_TEST_TTL = 24 * 60 * 60  # 1 day
+
+# Raw Cost Explorer responses, keyed by credential scope + request hash.
+# Billing data refreshes ~3 times a day and every CE request is billed
+CE_RESPONSE_KEY = "v1:aws:ce:{scope}:{request}"
+CE_RESPONSE_TTL = 8 * 60 * 60  # 8 hours
+
+# EC2/EBS describe listings, keyed by credential scope + region; short TTL
+# so repeat analyses share one listing without serving stale inventory
+RESOURCE_LISTING_KEY = "v1:aws:{listing}:{scope}:{region}"
+RESOURCE_LISTING_TTL = 5 * 60  # 5 minutes
+
+# Owner of each queued analysis task; status lookups are only answered for
+# the organization that started the task. Kept as long as Celery keeps results
+ANALYSIS_TASK_KEY = "v1:analysis-task:{task_id}"
+ANALYSIS_TASK_TTL = 24 * 60 * 60  # 1 day (celery result_expires)
+
+# Cached ML output, scoped per cloud account
+COST_PREDICTION_KEY = "v1:ml:cost-prediction:{account_id}"
+COST_PREDICTION_TTL = 24 * 60 * 60  # 1 day
+
+# Fitted anomaly model + forecast, keyed by the newest snapshot it covers,
+# so hourly anomaly checks only refit when new cost data has arrived
+ANOMALY_MODEL_KEY = "v1:ml:anomaly-model:{account_id}:{data_version}"
+ANOMALY_MODEL_TTL = 2 * 24 * 60 * 60  # 2 days
+
+LOCK_TTL_SECONDS = 5
+LOCK_WAIT_SECONDS = 0.05
+LOCK_WAIT_ATTEMPTS = 20
+
+
+async def _get(key: str):
+    try:
+        return await redis_client.get(key)
+    except RedisError as e:
+        logger.warning(f"Cache read failed for {key}: {str(e)}")
+        return None
+
+
+def _dumps(value: Any) -> bytes:
+    # ML output can carry numpy scalars
+    return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+async def get_json(key: str) -> Any:
+    """Return the cached JSON value for `key`, or None on a miss"""
+    cached = await _get(key)
+    return orjson.loads(cached) if cached is not None else None
+
+
+async def set_json(key: str, value: Any, ttl: int) -> None:
+    """Store a JSON value under `key` for `ttl` seconds"""
+    try:
+        await redis_client.set(key, _dumps(value), ex=ttl)
+    except RedisError as e:
+        logger.warning(f"Cache write failed for {key}: {str(e)}")
+
+
+def get_json_sync(key: str) -> Any:
+    """Return the cached JSON value for `key` from synchronous (Celery) code"""
+    try:
+        cached = sync_redis_client.get(key)
+    except RedisError as e:
+        logger.warning(f"Cache read failed for {key}: {str(e)}")
+        return None
+    return orjson.loads(cached) if cached is not None else None
+
+
+def set_json_sync(key: str, value: Any, ttl: int) -> None:
+    """Store a JSON value from synchronous (Celery) code"""
+    try:
+        sync_redis_client.set(key, _dumps(value), ex=ttl)
+    except RedisError as e:
+        logger.warning(f"Cache write failed for {key}: {str(e)}")
+
+
+async def cached_json(
+    key: str,
+    ttl: int,
+    compute: Callable[[], Awaitable[Any]],
+    lock: bool = False
+) -> bytes:
+    """
+    Return the encoded JSON body cached under `key`, computing and storing it on a miss.
+
+    The body is returned as bytes so a cache hit can be sent to the client
+    as-is, without a decode/re-encode round trip.
+
+    With lock=True only one caller recomputes an expired key (SET NX lock);
+    the others wait briefly for it to be filled instead of stampeding the DB.
+    """
+    cached = await _get(key)
+    if cached is not None:
+        return cached
+
+    if lock:
+        try:
+            acquired = await redis_client.set(f"{key}:lock", 1, nx=True, ex=LOCK_TTL_SECONDS)
+        except RedisError:
+            acquired = True
+
+        if not acquired:
+            for _ in range(LOCK_WAIT_ATTEMPTS):
+                await asyncio.sleep(LOCK_WAIT_SECONDS)
+                cached = await _get(key)
+                if cached is not None:
+                    return cached
+
+    body = _dumps(await compute())
+
+    try:
+        await redis_client.set(key, body, ex=ttl)
+        if lock:
+            await redis_client.delete(f"{key}:lock")
+    except RedisError as e:
+        logger.warning(f"Cache write failed for {key}: {str(e)}")
+
+    return body
+
+
+def invalidate_org_cache(org_id) -> None:
+    """Drop cached dashboard/recommendation responses for an organization"""
+    try:
+        keys = [DASHBOARD_KEY.format(org_id=org_id)]
+        keys.extend(sync_redis_client.scan_iter(match=RECOMMENDATIONS_KEY.format(org_id=org_id, limit="*")))
+        sync_redis_client.delete(*keys)
+    except RedisError as e:
+        logger.warning(f"Cache invalidation failed for org {org_id}: {str(e)}")
+
+
+def delete_pattern_sync(pattern: str) -> None:
+    """Delete every key matching a glob `pattern` from synchronous code"""
+    try:
+        keys = list(sync_redis_client.scan_iter(match=pattern))
+        if keys:
+            sync_redis_client.delete(*keys)
+    except RedisError as e:
+        logger.warning(f"Cache delete failed for {pattern}: {str(e)}")
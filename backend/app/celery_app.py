@@ -3,24 +3,28 @@ Celery configuration for background tasks
 """
 from celery import Celery
 from celery.schedules import crontab
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from kombu import Exchange, Queue
+from app.config import settings
 
 # Create Celery instance
 celery_app = Celery(
     'finops_analyzer',
-    broker=os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
-    backend=os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+    broker=settings.redis_url,
+    backend=settings.redis_url,
     include=['app.tasks']
 )
 
 # Configure Celery
 celery_app.conf.update(
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
+    # msgpack + gzip keeps large report/analysis payloads small in Redis;
+    # json stays accepted so messages queued before an upgrade still run
+    task_serializer='msgpack',
+    accept_content=['msgpack', 'json'],
+    result_serializer='msgpack',
+    result_accept_content=['msgpack', 'json'],
+    task_compression='gzip',
+    result_compression='gzip',
+    result_expires=24 * 60 * 60,  # 1 day
     timezone='UTC',
     enable_utc=True,
     task_track_started=True,
@@ -28,14 +32,46 @@ celery_app.conf.update(
     task_soft_time_limit=25 * 60,  # 25 minutes
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=1000,
+    # Ack after completion so a long task isn't lost if its worker dies;
+    # run workers with -O fair so they never reserve tasks behind a long one
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_disable_rate_limits=True,
+)
+
+# Queues: 'transient' skips broker persistence for disposable periodic
+# jobs - a lost message is simply replaced by the next beat tick
+celery_app.conf.task_queues = (
+    Queue('celery', routing_key='celery'),
+    Queue('io', routing_key='io'),
+    Queue('cpu', routing_key='cpu'),
+    Queue('transient', Exchange('transient', delivery_mode=1),
+          routing_key='transient', durable=False),
 )
 
+# Route I/O-bound (AWS/DB) and CPU-bound (ML) tasks to separate queues
+# so they can be served by differently sized worker pools
+celery_app.conf.task_routes = {
+    'app.tasks.run_daily_analysis': {'queue': 'io'},
+    'app.tasks.analyze_account': {'queue': 'io'},
+    'app.tasks.run_account_analysis': {'queue': 'io'},
+    'app.tasks.refresh_cost_predictions': {'queue': 'io'},
+    'app.tasks.train_cost_prediction': {'queue': 'cpu'},
+    'app.tasks.update_last_login': {'queue': 'io'},
+    'app.tasks.generate_optimization_report': {'queue': 'io'},
+    'app.tasks.check_cost_anomalies': {'queue': 'transient', 'delivery_mode': 'transient'},
+}
+
 # Configure periodic tasks
 celery_app.conf.beat_schedule = {
     'daily-cost-analysis': {
         'task': 'app.tasks.run_daily_analysis',
         'schedule': crontab(hour=2, minute=0),  # Run at 2 AM UTC daily
     },
+    'nightly-cost-prediction': {
+        'task': 'app.tasks.refresh_cost_predictions',
+        'schedule': crontab(hour=3, minute=0),  # After the daily analysis
+    },
     'hourly-anomaly-check': {
         'task': 'app.tasks.check_cost_anomalies',
         'schedule': crontab(minute=0),  # Run every hour
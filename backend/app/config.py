@@ -0,0 +1,56 @@
+"""
+Application configuration
+
+Environment settings are read from the process environment and the .env
+file, validated once, and exposed as typed attributes. Other modules
+import `settings` (or call `get_settings()`) instead of using os.getenv().
+"""
+from functools import lru_cache
+from typing import List, Optional
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """Resolved environment settings"""
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    # Database
+    database_url: Optional[str] = None
+    database_pool_size: int = 20
+    database_max_overflow: int = 10
+    database_pool_timeout: int = 30
+    database_pool_recycle: int = 3600
+
+    # Redis / Celery
+    redis_url: str = "redis://localhost:6379/0"
+    redis_max_connections: int = 20
+
+    # Security
+    secret_key: str = "your-secret-key-change-in-production"
+    algorithm: str = "HS256"
+    access_token_expire_minutes: int = 30
+    encryption_key: Optional[str] = None  # Fernet keys, newest first, comma-separated
+    encryption_key_secret_id: Optional[str] = None  # Secrets Manager secret holding the same
+
+    # Application
+    debug: bool = False
+    environment: str = "development"
+    app_version: str = "0.1.0"
+    log_level: str = "info"
+
+    # CORS (JSON list in the environment)
+    backend_cors_origins: List[str] = ["http://localhost:3000"]
+
+    # Server
+    host: str = "0.0.0.0"
+    port: int = 8000
+    web_concurrency: int = 1
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Build and validate settings once per process"""
+    return Settings()
+
+
+settings = get_settings()
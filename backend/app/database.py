@@ -1,35 +1,83 @@
 """
 Database configuration and session management
 
-This module sets up SQLAlchemy engine, session factory, and base class
+This module sets up SQLAlchemy engines, session factories, and base class
 for all database models.
-"""
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+FastAPI request handlers use the async engine (asyncpg driver) so database
+round-trips never block the event loop. Celery workers and Alembic keep
+using the synchronous engine.
+"""
+from typing import Any, AsyncIterator, Dict, List
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
+from sqlalchemy.pool import NullPool
+from app.config import settings
 
 # Get database URL from environment
-DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_URL = settings.database_url
 
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
-# Create SQLAlchemy engine
+
+def to_async_url(url: str) -> str:
+    """
+    Rewrite a synchronous Postgres URL to use the asyncpg driver.
+
+    Example:
+        postgresql://user:pw@host/db -> postgresql+asyncpg://user:pw@host/db
+    """
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+
+# Connection pool settings shared by both engines
+# pool_pre_ping discards stale connections on checkout instead of raising,
+# pool_recycle closes connections before server/proxy idle timeouts hit
+POOL_OPTIONS = {
+    "pool_size": settings.database_pool_size,
+    "max_overflow": settings.database_max_overflow,
+    "pool_timeout": settings.database_pool_timeout,
+    "pool_recycle": settings.database_pool_recycle,
+    "pool_pre_ping": True,
+}
+
+# Create async SQLAlchemy engine for request handlers
 # echo=True enables SQL query logging in development
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **POOL_OPTIONS,
+    echo=settings.debug,
+)
+
+# Create async session factory
+AsyncSessionLocal: async_sessionmaker[AsyncSession] = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+# Health-check probes get their own unpooled engine so a probe storm can
+# never starve request handlers of pooled connections
+health_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+HealthSessionLocal = async_sessionmaker(health_engine, class_=AsyncSession)
+
+# Create synchronous engine for Celery tasks and migrations
 engine = create_engine(
     DATABASE_URL,
-    pool_size=int(os.getenv("DATABASE_POOL_SIZE", "20")),
-    max_overflow=int(os.getenv("DATABASE_MAX_OVERFLOW", "0")),
-    echo=os.getenv("DEBUG", "False").lower() == "true",
+    **POOL_OPTIONS,
+    echo=settings.debug,
     future=True
 )
 
-# Create session factory
+# Create synchronous session factory
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
@@ -37,27 +85,40 @@ SessionLocal = sessionmaker(
     future=True
 )
 
-# Create base class for declarative models
-Base = declarative_base()
+# Connectivity probe used by health checks
+SELECT_ONE = text("SELECT 1")
+
+# Base class for declarative models
+class Base(DeclarativeBase):
+    pass
 
 
-def get_db():
+async def get_db() -> AsyncIterator[AsyncSession]:
     """
-    Database session dependency for FastAPI.
-    
+    Async database session dependency for FastAPI.
+
     Usage in route:
         @app.get("/items")
-        def read_items(db: Session = Depends(get_db)):
-            return db.query(Item).all()
-    
+        async def read_items(db: AsyncSession = Depends(get_db)):
+            result = await db.scalars(select(Item))
+            return result.all()
+
     Yields:
-        Session: SQLAlchemy database session
+        AsyncSession: SQLAlchemy async database session
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+def bulk_insert(db: Session, model, rows: List[Dict[str, Any]]) -> None:
+    """
+    Insert many rows in one executemany round-trip.
+
+    SQLAlchemy 2.0 batches this into multi-row INSERT statements
+    ("insertmanyvalues"); Python-side column defaults still apply.
+    """
+    if rows:
+        db.execute(insert(model), rows)
 
 
 def init_db():
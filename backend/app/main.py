@@ -3,36 +3,85 @@ Main FastAPI application for FinOps Analyzer
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
 from contextlib import asynccontextmanager
-import os
-from dotenv import load_dotenv
-from app.routers import auth
-from app.database import engine, Base
-from app.routers import analysis
-from app.routers import cloud_accounts
+from pathlib import Path
+import asyncio
+import logging
+import sys
+import time
+from app.config import settings
+from app.database import async_engine, HealthSessionLocal, Base, SELECT_ONE
+from app.cache import redis_client, redis_pool
+from app.routers import auth, analysis, cloud_accounts, ml_analysis
 
-# Load environment variables
-load_dotenv()
+# Resolve settings once at startup rather than on every request
+DEBUG = settings.debug
+ENVIRONMENT = settings.environment
+APP_VERSION = settings.app_version
+LOG_LEVEL = settings.log_level.lower()
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_DIR = Path(__file__).resolve().parent.parent / "alembic"
+
+
+def _schema_outdated(connection) -> bool:
+    """True when the database is not at the newest Alembic revision"""
+    config = Config()
+    config.set_main_option("script_location", str(ALEMBIC_DIR))
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    return set(MigrationContext.configure(connection).get_current_heads()) != heads
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup and shutdown"""
+    # Production schema is managed by Alembic (the migrations create every
+    # model table); only auto-create tables locally
+    if DEBUG:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    else:
+        try:
+            async with async_engine.connect() as conn:
+                outdated = await conn.run_sync(_schema_outdated)
+        except Exception as e:
+            logger.warning(f"Could not check the database schema revision: {str(e)}")
+        else:
+            if outdated:
+                logger.error("Database schema is behind the latest migration; run `alembic upgrade head`")
+    
+    yield
+    
+    await async_engine.dispose()
+    await redis_pool.disconnect()
 
-# Create database tables (they already exist in Supabase, but this is safe)
-Base.metadata.create_all(bind=engine)
 
 # Create FastAPI app
 app = FastAPI(
     title="FinOps Little Analyzer API",
     description="AI-powered cloud cost optimization for startups",
-    version="0.1.0",
+    version=APP_VERSION,
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    # orjson serializes large cost/resource payloads much faster than json
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:3000"],  # Frontend URL
+    allow_origins=settings.backend_cors_origins,  # Frontend URLs
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type", "X-Requested-With"],
+    expose_headers=["X-Request-Id"],
+    max_age=86400,  # Let browsers cache preflight responses for 24h
 )
 
 @app.get("/")
@@ -40,7 +89,7 @@ async def root():
     """Root endpoint"""
     return {
         "message": "FinOps Little Analyzer API",
-        "version": "0.1.0",
+        "version": APP_VERSION,
         "documentation": "/api/docs"
     }
 
@@ -49,33 +98,87 @@ async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "environment": os.getenv("ENVIRONMENT", "development")
+        "environment": ENVIRONMENT
     }
 
+# A successful DB probe is reused for this many seconds so liveness
+# probes hitting every few seconds don't each cost a round-trip
+DB_HEALTH_CACHE_SECONDS = 5
+_db_health_lock = asyncio.Lock()
+_db_last_ok = 0.0
+
+
+async def check_database():
+    """Run SELECT 1 against the database unless a recent probe succeeded"""
+    global _db_last_ok
+    
+    if time.monotonic() - _db_last_ok < DB_HEALTH_CACHE_SECONDS:
+        return
+    
+    async with _db_health_lock:
+        # Another probe may have refreshed the result while we waited
+        if time.monotonic() - _db_last_ok < DB_HEALTH_CACHE_SECONDS:
+            return
+        
+        async with HealthSessionLocal() as db:
+            await db.execute(SELECT_ONE)
+        _db_last_ok = time.monotonic()
+
 @app.get("/api/v1/test-db")
 async def test_database():
     """Test database connection"""
     try:
-        from app.database import SessionLocal
-        db = SessionLocal()
-        # Simple query to test connection
-        result = db.execute("SELECT 1")
-        db.close()
+        await check_database()
         return {"status": "connected", "message": "Database connection successful"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
-    
-    
-# Add auth router
-app.include_router(auth.router, prefix="/api/v1/auth", tags=["authentication"])
 
-# Add analysis router
-app.include_router(analysis.router, prefix="/api/v1/analysis", tags=["analysis"])
+@app.get("/api/health/db")
+async def database_health():
+    """Database health check endpoint"""
+    try:
+        await check_database()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Database unavailable: {str(e)}")
+    
+    return {"status": "healthy", "database": "connected"}
 
-# Add router
-app.include_router(cloud_accounts.router, prefix="/api/v1/cloud-accounts", tags=["cloud-accounts"])
+@app.get("/api/health/redis")
+async def redis_health():
+    """Redis health check endpoint"""
+    try:
+        await redis_client.ping()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Redis unavailable: {str(e)}")
+    
+    return {"status": "healthy", "redis": "connected"}
+    
+    
+# API routers: (router, prefix, tag)
+ROUTERS = (
+    (auth.router, "/api/v1/auth", "authentication"),
+    (analysis.router, "/api/v1/analysis", "analysis"),
+    (cloud_accounts.router, "/api/v1/cloud-accounts", "cloud-accounts"),
+    (ml_analysis.router, "/api/v1/ml", "ml-analysis"),
+)
 
+for router, prefix, tag in ROUTERS:
+    app.include_router(router, prefix=prefix, tags=[tag])
 
-from app.routers import ml_analysis
-app.include_router(ml_analysis.router, prefix="/api/v1/ml", tags=["ml-analysis"])
 
+if __name__ == "__main__":
+    import uvicorn
+    
+    uvicorn.run(
+        "app.main:app",
+        host=settings.host,
+        port=settings.port,
+        reload=DEBUG,
+        # --reload only supports a single worker
+        workers=1 if DEBUG else settings.web_concurrency,
+        # uvloop is not available on Windows
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        access_log=DEBUG,
+        log_level=LOG_LEVEL
+    )
@@ -1,118 +1,137 @@
 """
 AWS-specific resource models
 """
-from sqlalchemy import Column, String, Float, DateTime, JSON, ForeignKey, Boolean, Integer, Text
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy import String, Float, DateTime, ForeignKey, Boolean, Integer, Text, Index, text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
+from typing import TYPE_CHECKING, List, Optional
 import uuid
 
 from app.database import Base
 
+if TYPE_CHECKING:
+    from app.models.base import CloudAccount, Organization
+
 
 class AWSResource(Base):
     """Generic AWS resource tracking"""
     __tablename__ = "aws_resources"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    cloud_account_id = Column(UUID(as_uuid=True), ForeignKey("cloud_accounts.id"))
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cloud_account_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("cloud_accounts.id"))
     
     # Resource identification
-    resource_type = Column(String, nullable=False)  # ec2, rds, s3, ebs, etc.
-    resource_id = Column(String, nullable=False)
-    resource_arn = Column(String)
-    resource_name = Column(String)
+    resource_type: Mapped[str] = mapped_column(String(100), nullable=False)  # ec2, rds, s3, ebs, etc.
+    resource_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    resource_arn: Mapped[Optional[str]] = mapped_column(String(512))
+    resource_name: Mapped[Optional[str]] = mapped_column(String(255))
     
     # Location
-    region = Column(String, nullable=False)
-    availability_zone = Column(String)
+    region: Mapped[str] = mapped_column(String(50), nullable=False)
+    availability_zone: Mapped[Optional[str]] = mapped_column(String(50))
     
     # Status
-    state = Column(String)  # running, stopped, terminated, available
-    created_time = Column(DateTime)
+    state: Mapped[Optional[str]] = mapped_column(String(50))  # running, stopped, terminated, available
+    created_time: Mapped[Optional[datetime]] = mapped_column(DateTime)
     
     # Cost data
-    hourly_cost = Column(Float, default=0.0)
-    monthly_cost = Column(Float, default=0.0)
+    hourly_cost: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    monthly_cost: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
     
     # Metadata
-    tags = Column(JSON)
-    specifications = Column(JSON)  # Instance type, size, etc.
-    metrics = Column(JSON)  # CPU, memory, network usage
+    tags: Mapped[Optional[dict]] = mapped_column(JSONB)
+    specifications: Mapped[Optional[dict]] = mapped_column(JSONB)  # Instance type, size, etc.
+    metrics: Mapped[Optional[dict]] = mapped_column(JSONB)  # CPU, memory, network usage
     
     # Tracking
-    first_seen = Column(DateTime, default=datetime.utcnow)
-    last_seen = Column(DateTime, default=datetime.utcnow)
-    last_analyzed = Column(DateTime)
+    first_seen: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    last_seen: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    last_analyzed: Mapped[Optional[datetime]] = mapped_column(DateTime)
     
     # Relationships
-    cloud_account = relationship("CloudAccount", back_populates="aws_resources")
-    recommendations = relationship("Recommendation", back_populates="resource")
+    cloud_account: Mapped[Optional["CloudAccount"]] = relationship("CloudAccount", back_populates="aws_resources")
+    recommendations: Mapped[List["Recommendation"]] = relationship("Recommendation", back_populates="resource")
+    
+    __table_args__ = (
+        Index("ix_awsres_acct_type", "cloud_account_id", "resource_type"),
+        Index("ix_awsres_tags_gin", "tags", postgresql_using="gin"),
+    )
 
 
 class Recommendation(Base):
     """Cost optimization recommendations"""
     __tablename__ = "recommendations"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    resource_id = Column(UUID(as_uuid=True), ForeignKey("aws_resources.id"))
-    organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"))
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    resource_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("aws_resources.id"))
+    organization_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("organizations.id"))
     
     # Recommendation details
-    recommendation_type = Column(String, nullable=False)  # terminate, resize, schedule, reserve
-    title = Column(String, nullable=False)
-    description = Column(Text)
+    recommendation_type: Mapped[str] = mapped_column(String, nullable=False)  # terminate, resize, schedule, reserve
+    title: Mapped[str] = mapped_column(String, nullable=False)
+    description: Mapped[Optional[str]] = mapped_column(Text)
     
     # Financial impact
-    monthly_savings = Column(Float, nullable=False)
-    annual_savings = Column(Float)
-    implementation_cost = Column(Float, default=0.0)
+    monthly_savings: Mapped[float] = mapped_column(Float, nullable=False)
+    annual_savings: Mapped[Optional[float]] = mapped_column(Float)
+    implementation_cost: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
     
     # Risk and complexity
-    risk_level = Column(String, default="low")  # low, medium, high
-    complexity = Column(String, default="simple")  # simple, moderate, complex
-    confidence_score = Column(Float)  # 0-1 confidence in the recommendation
+    risk_level: Mapped[Optional[str]] = mapped_column(String, default="low")  # low, medium, high
+    complexity: Mapped[Optional[str]] = mapped_column(String, default="simple")  # simple, moderate, complex
+    confidence_score: Mapped[Optional[float]] = mapped_column(Float)  # 0-1 confidence in the recommendation
     
     # Implementation
-    action_steps = Column(JSON)  # List of steps to implement
-    automation_possible = Column(Boolean, default=False)
+    action_steps: Mapped[Optional[list]] = mapped_column(JSONB)  # List of steps to implement
+    automation_possible: Mapped[Optional[bool]] = mapped_column(Boolean, default=False)
     
     # Status tracking
-    status = Column(String, default="active")  # active, implemented, dismissed, expired
-    created_at = Column(DateTime, default=datetime.utcnow)
-    expires_at = Column(DateTime)
-    implemented_at = Column(DateTime)
-    dismissed_at = Column(DateTime)
+    status: Mapped[Optional[str]] = mapped_column(String, default="active")  # active, implemented, dismissed, expired
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    implemented_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    dismissed_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
     
     # Relationships
-    resource = relationship("AWSResource", back_populates="recommendations")
-    organization = relationship("Organization")
+    resource: Mapped[Optional["AWSResource"]] = relationship("AWSResource", back_populates="recommendations")
+    organization: Mapped[Optional["Organization"]] = relationship("Organization")
+    
+    # Recommendation lists filter by org + status and sort by savings
+    __table_args__ = (
+        Index("ix_rec_org_status_savings", "organization_id", "status", text("monthly_savings DESC")),
+    )
 
 
 class CostSnapshot(Base):
     """Daily/hourly cost tracking for trends"""
     __tablename__ = "cost_snapshots"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"))
-    cloud_account_id = Column(UUID(as_uuid=True), ForeignKey("cloud_accounts.id"))
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    organization_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("organizations.id"))
+    cloud_account_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("cloud_accounts.id"))
     
     # Snapshot data
-    snapshot_date = Column(DateTime, nullable=False)
-    granularity = Column(String, default="daily")  # hourly, daily, monthly
+    snapshot_date: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    granularity: Mapped[Optional[str]] = mapped_column(String, default="daily")  # hourly, daily, monthly
     
     # Cost breakdown
-    total_cost = Column(Float, nullable=False)
-    compute_cost = Column(Float)
-    storage_cost = Column(Float)
-    network_cost = Column(Float)
-    database_cost = Column(Float)
-    other_cost = Column(Float)
+    total_cost: Mapped[float] = mapped_column(Float, nullable=False)
+    compute_cost: Mapped[Optional[float]] = mapped_column(Float)
+    storage_cost: Mapped[Optional[float]] = mapped_column(Float)
+    network_cost: Mapped[Optional[float]] = mapped_column(Float)
+    database_cost: Mapped[Optional[float]] = mapped_column(Float)
+    other_cost: Mapped[Optional[float]] = mapped_column(Float)
     
     # Service breakdown (JSON for flexibility)
-    service_costs = Column(JSON)  # {"EC2": 100.50, "RDS": 50.25, ...}
+    service_costs: Mapped[Optional[dict]] = mapped_column(JSONB)  # {"EC2": 100.50, "RDS": 50.25, ...}
     
     # Resource counts
-    resource_counts = Column(JSON)  # {"ec2_instances": 10, "rds_instances": 2, ...}
+    resource_counts: Mapped[Optional[dict]] = mapped_column(JSONB)  # {"ec2_instances": 10, "rds_instances": 2, ...}
+    
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # Dashboard and predictions read the latest snapshots per organization
+    __table_args__ = (
+        Index("ix_cost_snapshots_org_date", "organization_id", text("snapshot_date DESC")),
+    )
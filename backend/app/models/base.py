@@ -10,15 +10,19 @@ Models:
 - Recommendation: Optimization recommendations
 - SavingsReport: Historical savings reports
 """
-from sqlalchemy import Column, String, Float, DateTime, JSON, ForeignKey, Boolean, Integer, Enum, Text
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy import String, Float, DateTime, ForeignKey, Boolean, Integer, Enum, Text, Index, text
+from sqlalchemy.dialects.postgresql import UUID, CITEXT, JSONB
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
+from typing import TYPE_CHECKING, List, Optional
 import uuid
 import enum
 
 from app.database import Base
 
+if TYPE_CHECKING:
+    from app.models.aws_resources import AWSResource
+
 
 # Enums
 class SubscriptionTier(str, enum.Enum):
@@ -68,40 +72,40 @@ class Organization(Base):
     __tablename__ = "organizations"
     
     # Primary key
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # Basic information
-    name = Column(String(255), nullable=False)
-    email = Column(String(255), unique=True, nullable=False, index=True)
+    name: Mapped[str] = mapped_column(String(255), nullable=False)
+    email: Mapped[str] = mapped_column(CITEXT, unique=True, nullable=False, index=True)  # Case-insensitive
     
     # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
     # Subscription information
-    subscription_tier = Column(Enum(SubscriptionTier), default=SubscriptionTier.TRIAL, nullable=False)
-    subscription_status = Column(String(50), default="active", nullable=False)
-    subscription_start_date = Column(DateTime)
-    subscription_end_date = Column(DateTime)
-    stripe_customer_id = Column(String(255), unique=True, index=True)
-    stripe_subscription_id = Column(String(255))
+    subscription_tier: Mapped[SubscriptionTier] = mapped_column(Enum(SubscriptionTier), default=SubscriptionTier.TRIAL, nullable=False)
+    subscription_status: Mapped[str] = mapped_column(String(50), default="active", nullable=False)
+    subscription_start_date: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    subscription_end_date: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    stripe_customer_id: Mapped[Optional[str]] = mapped_column(String(255), unique=True, index=True)
+    stripe_subscription_id: Mapped[Optional[str]] = mapped_column(String(255))
     
     # Usage metrics
-    monthly_cloud_spend = Column(Float, default=0.0)
-    total_savings_identified = Column(Float, default=0.0)
-    total_savings_implemented = Column(Float, default=0.0)
+    monthly_cloud_spend: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    total_savings_identified: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    total_savings_implemented: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
     
     # Settings (JSON field for flexible configuration)
-    settings = Column(JSON, default={})
+    settings: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)
     
     # Soft delete
-    is_active = Column(Boolean, default=True, nullable=False)
-    deleted_at = Column(DateTime)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
+    deleted_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
     
     # Relationships
-    users = relationship("User", back_populates="organization", cascade="all, delete-orphan")
-    cloud_accounts = relationship("CloudAccount", back_populates="organization", cascade="all, delete-orphan")
-    savings_reports = relationship("SavingsReport", back_populates="organization", cascade="all, delete-orphan")
+    users: Mapped[List["User"]] = relationship("User", back_populates="organization", cascade="all, delete-orphan")
+    cloud_accounts: Mapped[List["CloudAccount"]] = relationship("CloudAccount", back_populates="organization", cascade="all, delete-orphan")
+    savings_reports: Mapped[List["SavingsReport"]] = relationship("SavingsReport", back_populates="organization", cascade="all, delete-orphan")
 
 
 class User(Base):
@@ -112,41 +116,41 @@ class User(Base):
     __tablename__ = "users"
     
     # Primary key
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # Foreign keys
-    organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=False, index=True)
+    organization_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=False, index=True)
     
     # Authentication
-    email = Column(String(255), unique=True, nullable=False, index=True)
-    hashed_password = Column(String(255), nullable=False)
+    email: Mapped[str] = mapped_column(CITEXT, unique=True, nullable=False, index=True)  # Case-insensitive
+    hashed_password: Mapped[str] = mapped_column(String(255), nullable=False)
     
     # Profile
-    full_name = Column(String(255))
-    avatar_url = Column(String(512))
+    full_name: Mapped[Optional[str]] = mapped_column(String(255))
+    avatar_url: Mapped[Optional[str]] = mapped_column(String(512))
     
     # Authorization
-    role = Column(Enum(UserRole), default=UserRole.MEMBER, nullable=False)
+    role: Mapped[UserRole] = mapped_column(Enum(UserRole), default=UserRole.MEMBER, nullable=False)
     
     # Status
-    is_active = Column(Boolean, default=True, nullable=False)
-    is_email_verified = Column(Boolean, default=False, nullable=False)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
+    is_email_verified: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     
     # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
-    last_login = Column(DateTime)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    last_login: Mapped[Optional[datetime]] = mapped_column(DateTime)
     
     # Email verification
-    email_verification_token = Column(String(255))
-    email_verified_at = Column(DateTime)
+    email_verification_token: Mapped[Optional[str]] = mapped_column(String(255))
+    email_verified_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
     
     # Password reset
-    password_reset_token = Column(String(255))
-    password_reset_expires = Column(DateTime)
+    password_reset_token: Mapped[Optional[str]] = mapped_column(String(255))
+    password_reset_expires: Mapped[Optional[datetime]] = mapped_column(DateTime)
     
     # Relationships
-    organization = relationship("Organization", back_populates="users")
+    organization: Mapped["Organization"] = relationship("Organization", back_populates="users")
 
 
 class CloudAccount(Base):
@@ -157,45 +161,50 @@ class CloudAccount(Base):
     __tablename__ = "cloud_accounts"
     
     # Primary key
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # Foreign keys
-    organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=False, index=True)
+    organization_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=False, index=True)
     
     # Account information
-    provider = Column(Enum(CloudProvider), nullable=False)
-    account_id = Column(String(255), nullable=False)  # AWS Account ID, GCP Project ID, etc.
-    account_name = Column(String(255))
+    provider: Mapped[CloudProvider] = mapped_column(Enum(CloudProvider), nullable=False)
+    account_id: Mapped[str] = mapped_column(String(255), nullable=False)  # AWS Account ID, GCP Project ID, etc.
+    account_name: Mapped[Optional[str]] = mapped_column(String(255))
     
     # Credentials (encrypted at rest)
-    credentials_encrypted = Column(Text, nullable=False)
-    encryption_key_id = Column(String(255))  # Reference to encryption key
+    credentials_encrypted: Mapped[str] = mapped_column(Text, nullable=False)
+    encryption_key_id: Mapped[Optional[str]] = mapped_column(String(255))  # Reference to encryption key
     
     # Status
-    is_active = Column(Boolean, default=True, nullable=False)
-    is_syncing = Column(Boolean, default=False, nullable=False)
-    last_sync = Column(DateTime)
-    last_sync_status = Column(String(50))  # success, failed, partial
-    last_sync_error = Column(Text)
-    next_sync_scheduled = Column(DateTime)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
+    is_syncing: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    last_sync: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    last_sync_status: Mapped[Optional[str]] = mapped_column(String(50))  # success, failed, partial
+    last_sync_error: Mapped[Optional[str]] = mapped_column(Text)
+    next_sync_scheduled: Mapped[Optional[datetime]] = mapped_column(DateTime)
     
     # Metrics
-    resource_count = Column(Integer, default=0)
-    monthly_spend = Column(Float, default=0.0)
+    resource_count: Mapped[Optional[int]] = mapped_column(Integer, default=0)
+    monthly_spend: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
     
     # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
     # Settings
-    sync_frequency_hours = Column(Integer, default=24)  # How often to sync
-    regions_enabled = Column(JSON, default=[])  # Which regions to analyze
+    sync_frequency_hours: Mapped[Optional[int]] = mapped_column(Integer, default=24)  # How often to sync
+    regions_enabled: Mapped[Optional[list]] = mapped_column(JSONB, default=list)  # Which regions to analyze
     
     # Relationships
-    organization = relationship("Organization", back_populates="cloud_accounts")
-    resources = relationship("Resource", back_populates="cloud_account", cascade="all, delete-orphan")
-    anomalies = relationship("Anomaly", back_populates="cloud_account", cascade="all, delete-orphan")
-    aws_resources = relationship("AWSResource", back_populates="cloud_account")
+    organization: Mapped["Organization"] = relationship("Organization", back_populates="cloud_accounts")
+    resources: Mapped[List["Resource"]] = relationship("Resource", back_populates="cloud_account", cascade="all, delete-orphan")
+    anomalies: Mapped[List["Anomaly"]] = relationship("Anomaly", back_populates="cloud_account", cascade="all, delete-orphan")
+    aws_resources: Mapped[List["AWSResource"]] = relationship("AWSResource", back_populates="cloud_account")
+    
+    # A provider account can only be connected once per organization
+    __table_args__ = (
+        Index("uq_cloud_accounts_org_account", "organization_id", "account_id", unique=True),
+    )
 
 
 class Resource(Base):
@@ -205,52 +214,58 @@ class Resource(Base):
     __tablename__ = "resources"
     
     # Primary key
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # Foreign keys
-    cloud_account_id = Column(UUID(as_uuid=True), ForeignKey("cloud_accounts.id"), nullable=False, index=True)
+    cloud_account_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("cloud_accounts.id"), nullable=False, index=True)
     
     # Resource identification
-    resource_type = Column(String(100), nullable=False, index=True)  # ec2_instance, rds_instance, s3_bucket
-    resource_id = Column(String(255), nullable=False)  # Cloud provider's resource ID
-    resource_name = Column(String(255))
-    resource_arn = Column(String(512))  # AWS ARN or equivalent
+    resource_type: Mapped[str] = mapped_column(String(100), nullable=False, index=True)  # ec2_instance, rds_instance, s3_bucket
+    resource_id: Mapped[str] = mapped_column(String(255), nullable=False)  # Cloud provider's resource ID
+    resource_name: Mapped[Optional[str]] = mapped_column(String(255))
+    resource_arn: Mapped[Optional[str]] = mapped_column(String(512))  # AWS ARN or equivalent
     
     # Location
-    region = Column(String(50))
-    availability_zone = Column(String(50))
+    region: Mapped[Optional[str]] = mapped_column(String(50))
+    availability_zone: Mapped[Optional[str]] = mapped_column(String(50))
     
     # Tags (from cloud provider)
-    tags = Column(JSON, default={})
+    tags: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)
     
     # State
-    state = Column(String(50))  # running, stopped, terminated, etc.
+    state: Mapped[Optional[str]] = mapped_column(String(50))  # running, stopped, terminated, etc.
     
     # Cost information
-    cost_per_hour = Column(Float, default=0.0)
-    cost_per_day = Column(Float, default=0.0)
-    cost_per_month = Column(Float, default=0.0)
-    currency = Column(String(3), default="USD")
+    cost_per_hour: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    cost_per_day: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    cost_per_month: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    currency: Mapped[Optional[str]] = mapped_column(String(3), default="USD")
     
     # Utilization metrics
-    utilization_percent = Column(Float)  # Average utilization
-    utilization_metrics = Column(JSON, default={})  # Detailed metrics
+    utilization_percent: Mapped[Optional[float]] = mapped_column(Float)  # Average utilization
+    utilization_metrics: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)  # Detailed metrics
     
     # Specifications
-    size_spec = Column(JSON, default={})  # Instance type, storage size, etc.
+    size_spec: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)  # Instance type, storage size, etc.
     
     # Additional metadata
-    resource_metadata = Column(JSON, default={})
+    resource_metadata: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)
     
     # Timestamps
-    first_seen = Column(DateTime, default=datetime.utcnow, nullable=False)
-    last_seen = Column(DateTime, default=datetime.utcnow, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    first_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    last_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
     # Relationships
-    cloud_account = relationship("CloudAccount", back_populates="resources")
-    anomalies = relationship("Anomaly", back_populates="resource")
+    cloud_account: Mapped["CloudAccount"] = relationship("CloudAccount", back_populates="resources")
+    anomalies: Mapped[List["Anomaly"]] = relationship("Anomaly", back_populates="resource")
+    
+    # Dashboard filters resources by account, type and state
+    __table_args__ = (
+        Index("ix_resources_acct_type_state", "cloud_account_id", "resource_type", "state"),
+        Index("ix_resources_tags_gin", "tags", postgresql_using="gin"),
+    )
 
 
 class Anomaly(Base):
@@ -261,48 +276,56 @@ class Anomaly(Base):
     __tablename__ = "anomalies"
     
     # Primary key
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # Foreign keys
-    cloud_account_id = Column(UUID(as_uuid=True), ForeignKey("cloud_accounts.id"), nullable=False, index=True)
-    resource_id = Column(UUID(as_uuid=True), ForeignKey("resources.id"), nullable=True, index=True)
+    cloud_account_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("cloud_accounts.id"), nullable=False, index=True)
+    resource_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("resources.id"), nullable=True, index=True)
     
     # Classification
-    anomaly_type = Column(String(100), nullable=False, index=True)  # unused, overprovisioned, cost_spike
-    category = Column(String(100))  # compute, storage, network, database
+    anomaly_type: Mapped[str] = mapped_column(String(100), nullable=False, index=True)  # unused, overprovisioned, cost_spike
+    category: Mapped[Optional[str]] = mapped_column(String(100))  # compute, storage, network, database
     
     # Severity and confidence
-    severity = Column(Enum(AnomalySeverity), default=AnomalySeverity.MEDIUM, nullable=False)
-    confidence_score = Column(Float)  # 0.0 to 1.0
+    severity: Mapped[AnomalySeverity] = mapped_column(Enum(AnomalySeverity), default=AnomalySeverity.MEDIUM, nullable=False)
+    confidence_score: Mapped[Optional[float]] = mapped_column(Float)  # 0.0 to 1.0
     
     # Status
-    status = Column(Enum(AnomalyStatus), default=AnomalyStatus.ACTIVE, nullable=False)
+    status: Mapped[AnomalyStatus] = mapped_column(Enum(AnomalyStatus), default=AnomalyStatus.ACTIVE, nullable=False)
     
     # Timestamps
-    detected_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
-    resolved_at = Column(DateTime)
-    acknowledged_at = Column(DateTime)
+    detected_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    resolved_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    acknowledged_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
     
     # Financial impact
-    potential_monthly_savings = Column(Float, default=0.0)
-    actual_savings_achieved = Column(Float, default=0.0)
-    cost_impact = Column(Float, default=0.0)
+    potential_monthly_savings: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    actual_savings_achieved: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    cost_impact: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
     
     # Description and recommendation
-    title = Column(String(255), nullable=False)
-    description = Column(Text)
-    recommendation = Column(JSON, default={})  # Structured recommendation with steps
+    title: Mapped[str] = mapped_column(String(255), nullable=False)
+    description: Mapped[Optional[str]] = mapped_column(Text)
+    recommendation: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)  # Structured recommendation with steps
     
     # Detection method
-    detection_method = Column(String(100))  # ml_model, rule_based, user_reported
-    model_version = Column(String(50))
+    detection_method: Mapped[Optional[str]] = mapped_column(String(100))  # ml_model, rule_based, user_reported
+    model_version: Mapped[Optional[str]] = mapped_column(String(50))
     
     # Additional data
-    evidence = Column(JSON, default={})  # Supporting data for the anomaly
+    evidence: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)  # Supporting data for the anomaly
     
     # Relationships
-    cloud_account = relationship("CloudAccount", back_populates="anomalies")
-    resource = relationship("Resource", back_populates="anomalies")
+    cloud_account: Mapped["CloudAccount"] = relationship("CloudAccount", back_populates="anomalies")
+    resource: Mapped[Optional["Resource"]] = relationship("Resource", back_populates="anomalies")
+    
+    # Dashboard lists open anomalies per account, newest first
+    __table_args__ = (
+        Index(
+            "ix_anomalies_open", "cloud_account_id", "detected_at",
+            postgresql_where=text("status = 'ACTIVE'")
+        ),
+    )
 
 
 class SavingsReport(Base):
@@ -313,34 +336,34 @@ class SavingsReport(Base):
     __tablename__ = "savings_reports"
     
     # Primary key
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # Foreign keys
-    organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=False, index=True)
+    organization_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=False, index=True)
     
     # Report metadata
-    report_date = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
-    report_type = Column(String(50), default="monthly")  # daily, weekly, monthly, quarterly
+    report_date: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    report_type: Mapped[Optional[str]] = mapped_column(String(50), default="monthly")  # daily, weekly, monthly, quarterly
     
     # Financial metrics
-    total_spend = Column(Float, default=0.0)
-    identified_savings = Column(Float, default=0.0)
-    implemented_savings = Column(Float, default=0.0)
-    savings_percentage = Column(Float, default=0.0)
+    total_spend: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    identified_savings: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    implemented_savings: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
+    savings_percentage: Mapped[Optional[float]] = mapped_column(Float, default=0.0)
     
     # Breakdown by service/category
-    spend_by_service = Column(JSON, default={})
-    savings_by_category = Column(JSON, default={})
+    spend_by_service: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)
+    savings_by_category: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)
     
     # Top recommendations
-    top_recommendations = Column(JSON, default=[])
+    top_recommendations: Mapped[Optional[list]] = mapped_column(JSONB, default=list)
     
     # Full report data
-    report_data = Column(JSON, default={})
+    report_data: Mapped[Optional[dict]] = mapped_column(JSONB, default=dict)
     
     # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Relationships
-    organization = relationship("Organization", back_populates="savings_reports")
+    organization: Mapped["Organization"] = relationship("Organization", back_populates="savings_reports")
 
@@ -1,24 +1,132 @@
 """
 Analysis API endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from celery.result import AsyncResult
+from sqlalchemy import select, bindparam, cast, func, literal_column, true, Integer, Text
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
 from typing import List, Dict, Any
-from datetime import datetime
 from pydantic import BaseModel
+import asyncio
 import logging
+import orjson
 
 from app.database import get_db
+from app.cache import (
+    cached_json,
+    get_json_sync,
+    set_json,
+    ANALYSIS_TASK_KEY,
+    ANALYSIS_TASK_TTL,
+    DASHBOARD_KEY,
+    RECOMMENDATIONS_KEY
+)
 from app.models.base import CloudAccount, Organization
 from app.models.aws_resources import AWSResource, Recommendation, CostSnapshot
 from app.utils.auth import get_current_user
-from app.services.aws_cost_explorer import AWSCostExplorer
-from app.services.aws_ec2_analyzer import EC2Analyzer
-from app.services.aws_storage_analyzer import StorageAnalyzer
+from app.celery_app import celery_app
+from app.tasks import run_account_analysis
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Dashboard data only changes when an analysis runs (which invalidates it)
+DASHBOARD_CACHE_SECONDS = 60
+RECOMMENDATIONS_CACHE_SECONDS = 60
+
+# Statements are built once at import and executed with bound parameters,
+# so each request reuses the cached compiled SQL
+ACCOUNT_FOR_ORG = select(CloudAccount).where(
+    CloudAccount.id == bindparam("account_id"),
+    CloudAccount.organization_id == bindparam("org_id")
+)
+
+# Only the columns the endpoint serializes are fetched
+TOP_RECOMMENDATIONS = select(Recommendation).options(load_only(
+    Recommendation.id,
+    Recommendation.recommendation_type,
+    Recommendation.title,
+    Recommendation.description,
+    Recommendation.monthly_savings,
+    Recommendation.risk_level,
+    Recommendation.confidence_score,
+    Recommendation.action_steps,
+    Recommendation.created_at
+)).where(
+    Recommendation.organization_id == bindparam("org_id"),
+    Recommendation.status == "active"
+).order_by(
+    Recommendation.monthly_savings.desc()
+).limit(bindparam("limit", type_=Integer))
+
+# Totals over all active recommendations, computed by the database
+ACTIVE_RECOMMENDATION_TOTALS = select(
+    func.coalesce(func.sum(Recommendation.monthly_savings), 0),
+    func.count(Recommendation.id)
+).where(
+    Recommendation.organization_id == bindparam("org_id"),
+    Recommendation.status == "active"
+)
+
+# The whole dashboard in one round trip: active-recommendation totals,
+# the latest snapshot (outer-joined, may be absent) and the top five
+# recommendations pre-encoded as a JSON array by Postgres.
+# service_costs and the top five come back as JSON text and are embedded
+# in the response verbatim instead of being decoded and re-encoded
+_dashboard_totals = select(
+    func.coalesce(func.sum(Recommendation.monthly_savings), 0).label("potential_savings"),
+    func.count(Recommendation.id).label("active_count")
+).where(
+    Recommendation.organization_id == bindparam("org_id"),
+    Recommendation.status == "active"
+).subquery("totals")
+
+_dashboard_snapshot = select(
+    CostSnapshot.total_cost,
+    CostSnapshot.snapshot_date,
+    cast(CostSnapshot.service_costs, Text).label("service_costs_json")
+).where(
+    CostSnapshot.organization_id == bindparam("org_id")
+).order_by(CostSnapshot.snapshot_date.desc()).limit(1).subquery("latest")
+
+_dashboard_top = select(
+    Recommendation.title,
+    Recommendation.monthly_savings,
+    Recommendation.risk_level
+).where(
+    Recommendation.organization_id == bindparam("org_id"),
+    Recommendation.status == "active"
+).order_by(
+    Recommendation.monthly_savings.desc()
+).limit(5).subquery("top")
+
+_dashboard_top_json = select(
+    func.coalesce(
+        func.json_agg(aggregate_order_by(
+            func.json_build_object(
+                literal_column("'title'"), _dashboard_top.c.title,
+                literal_column("'savings'"), _dashboard_top.c.monthly_savings,
+                literal_column("'risk'"), _dashboard_top.c.risk_level
+            ),
+            _dashboard_top.c.monthly_savings.desc()
+        )),
+        literal_column("'[]'::json")
+    )
+).scalar_subquery()
+
+DASHBOARD_SUMMARY = select(
+    _dashboard_totals.c.potential_savings,
+    _dashboard_totals.c.active_count,
+    _dashboard_snapshot.c.total_cost,
+    _dashboard_snapshot.c.snapshot_date,
+    _dashboard_snapshot.c.service_costs_json,
+    cast(_dashboard_top_json, Text).label("top_recommendations_json")
+).select_from(
+    _dashboard_totals.outerjoin(_dashboard_snapshot, true())
+)
+
 
 class AnalysisRequest(BaseModel):
     cloud_account_id: str
@@ -35,211 +143,138 @@ class AnalysisResponse(BaseModel):
 @router.post("/analyze", response_model=AnalysisResponse)
 async def run_analysis(
     request: AnalysisRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """Run cost analysis on a cloud account"""
     
     # Verify account belongs to user's organization
-    account = db.query(CloudAccount).filter(
-        CloudAccount.id == request.cloud_account_id,
-        CloudAccount.organization_id == current_user.organization_id
-    ).first()
+    account = await db.scalar(ACCOUNT_FOR_ORG, {
+        "account_id": request.cloud_account_id,
+        "org_id": current_user.organization_id
+    })
     
     if not account:
         raise HTTPException(status_code=404, detail="Cloud account not found")
     
-    # Run analysis in background
-    background_tasks.add_task(
-        run_account_analysis,
-        account.id,
-        account.credentials_encrypted,
-        request.analysis_types,
-        db
-    )
+    # Hand the analysis off to a Celery worker; it loads the account
+    # (and its credentials) with its own session. Publishing is a blocking
+    # broker round-trip (with retries), so keep it off the event loop
+    task = await asyncio.to_thread(run_account_analysis.delay, str(account.id), request.analysis_types)
+    
+    # Remember who started it so only this organization can read the result
+    await set_json(ANALYSIS_TASK_KEY.format(task_id=task.id), {
+        'org_id': str(current_user.organization_id),
+        'task': run_account_analysis.name
+    }, ANALYSIS_TASK_TTL)
     
     return AnalysisResponse(
         status="started",
         message="Analysis started in background",
-        analysis_id=str(account.id)
+        analysis_id=task.id
     )
 
 
-def run_account_analysis(
-    account_id: str,
-    encrypted_credentials: str,
-    analysis_types: List[str],
-    db: Session
+@router.get("/analyze/{task_id}")
+def get_analysis_status(
+    task_id: str,
+    current_user = Depends(get_current_user)
 ):
-    """Run the actual analysis (background task)"""
-    try:
-        results = {}
-        
-        # Cost Analysis
-        if "cost" in analysis_types:
-            cost_explorer = AWSCostExplorer(encrypted_credentials)
-            results['cost'] = {
-                'current_month': cost_explorer.get_current_month_spend(),
-                'daily_costs': cost_explorer.get_daily_costs(30),
-                'service_breakdown': cost_explorer.get_service_costs(30),
-                'anomalies': cost_explorer.detect_cost_anomalies()
-            }
-            
-            # Store cost snapshot
-            if results['cost']['current_month'].get('total'):
-                snapshot = CostSnapshot(
-                    cloud_account_id=account_id,
-                    organization_id=db.query(CloudAccount).get(account_id).organization_id,
-                    snapshot_date=datetime.utcnow(),
-                    total_cost=results['cost']['current_month']['total'],
-                    service_costs=results['cost']['service_breakdown']
-                )
-                db.add(snapshot)
-        
-        # EC2 Analysis
-        if "ec2" in analysis_types:
-            ec2_analyzer = EC2Analyzer(encrypted_credentials)
-            instances = ec2_analyzer.get_all_instances()
-            opportunities = ec2_analyzer.find_optimization_opportunities()
-            
-            results['ec2'] = {
-                'total_instances': len(instances),
-                'total_monthly_cost': sum(i['monthly_cost'] for i in instances),
-                'opportunities': opportunities,
-                'potential_savings': sum(o.get('monthly_savings', 0) for o in opportunities)
-            }
-            
-            # Store recommendations in database
-            for opp in opportunities:
-                rec = Recommendation(
-                    organization_id=db.query(CloudAccount).get(account_id).organization_id,
-                    recommendation_type=opp['type'],
-                    title=f"{opp['type'].replace('_', ' ').title()}",
-                    description=opp['reason'],
-                    monthly_savings=opp.get('monthly_savings', 0),
-                    risk_level=opp.get('risk', 'medium'),
-                    confidence_score=opp.get('confidence', 0.5),
-                    action_steps=[opp['action']]
-                )
-                db.add(rec)
-        
-        # Storage Analysis
-        if "storage" in analysis_types:
-            storage_analyzer = StorageAnalyzer(encrypted_credentials)
-            ebs_results = storage_analyzer.analyze_ebs_volumes()
-            s3_results = storage_analyzer.analyze_s3_buckets()
-            
-            results['storage'] = {
-                'ebs': ebs_results,
-                's3': s3_results,
-                'total_monthly_cost': ebs_results['total_monthly_cost'] + s3_results['total_monthly_cost'],
-                'total_recommendations': len(ebs_results['recommendations']) + len(s3_results['recommendations'])
-            }
-            
-            # Store storage recommendations
-            for rec_data in ebs_results['recommendations'] + s3_results['recommendations']:
-                rec = Recommendation(
-                    organization_id=db.query(CloudAccount).get(account_id).organization_id,
-                    recommendation_type=rec_data['type'],
-                    title=f"{rec_data['type'].replace('_', ' ').title()}",
-                    description=rec_data['reason'],
-                    monthly_savings=rec_data.get('monthly_savings', 0),
-                    risk_level=rec_data.get('risk', 'medium'),
-                    confidence_score=rec_data.get('confidence', 0.5),
-                    action_steps=[rec_data['action']]
-                )
-                db.add(rec)
-        
-        # Update last sync status
-        account = db.query(CloudAccount).get(account_id)
-        account.last_sync = datetime.utcnow()
-        account.last_sync_status = "success"
-        
-        db.commit()
-        logger.info(f"Analysis completed for account {account_id}")
-        
-    except Exception as e:
-        logger.error(f"Analysis failed for account {account_id}: {str(e)}")
-        
-        # Update sync status
-        account = db.query(CloudAccount).get(account_id)
-        if account:
-            account.last_sync = datetime.utcnow()
-            account.last_sync_status = f"failed: {str(e)}"
-            db.commit()
+    """
+    Get the status of a background analysis
+
+    Plain def: the result backend lookup is a blocking Redis call, so
+    FastAPI runs it in its threadpool instead of on the event loop.
+
+    Only analyses started by the caller's organization are visible; any
+    other task id (including other Celery tasks) is reported as not found.
+    """
+    owner = get_json_sync(ANALYSIS_TASK_KEY.format(task_id=task_id))
+    if (
+        not owner
+        or owner.get('task') != run_account_analysis.name
+        or owner.get('org_id') != str(current_user.organization_id)
+    ):
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    result = AsyncResult(task_id, app=celery_app)
+    
+    return {
+        'analysis_id': task_id,
+        'status': result.state,
+        'result': result.result if result.successful() else None
+    }
 
 
 @router.get("/recommendations")
 async def get_recommendations(
     limit: int = 10,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """Get top recommendations for the organization"""
     
-    recommendations = db.query(Recommendation).filter(
-        Recommendation.organization_id == current_user.organization_id,
-        Recommendation.status == "active"
-    ).order_by(
-        Recommendation.monthly_savings.desc()
-    ).limit(limit).all()
+    async def compute():
+        recommendations = (await db.scalars(TOP_RECOMMENDATIONS, {
+            "org_id": current_user.organization_id,
+            "limit": limit
+        })).all()
+        
+        # Count and savings across every active recommendation, not just this page
+        potential_savings, total = (await db.execute(ACTIVE_RECOMMENDATION_TOTALS, {
+            "org_id": current_user.organization_id
+        })).one()
+        
+        return {
+            'total': total,
+            'potential_monthly_savings': potential_savings,
+            'recommendations': [
+                {
+                    'id': str(r.id),
+                    'type': r.recommendation_type,
+                    'title': r.title,
+                    'description': r.description,
+                    'monthly_savings': r.monthly_savings,
+                    'risk_level': r.risk_level,
+                    'confidence': r.confidence_score,
+                    'actions': r.action_steps,
+                    'created_at': r.created_at.isoformat()
+                }
+                for r in recommendations
+            ]
+        }
     
-    return {
-        'total': len(recommendations),
-        'potential_monthly_savings': sum(r.monthly_savings for r in recommendations),
-        'recommendations': [
-            {
-                'id': str(r.id),
-                'type': r.recommendation_type,
-                'title': r.title,
-                'description': r.description,
-                'monthly_savings': r.monthly_savings,
-                'risk_level': r.risk_level,
-                'confidence': r.confidence_score,
-                'actions': r.action_steps,
-                'created_at': r.created_at.isoformat()
-            }
-            for r in recommendations
-        ]
-    }
+    key = RECOMMENDATIONS_KEY.format(org_id=current_user.organization_id, limit=limit)
+    body = await cached_json(key, RECOMMENDATIONS_CACHE_SECONDS, compute)
+    return Response(content=body, media_type="application/json")
 
 
 @router.get("/dashboard")
 async def get_dashboard_data(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """Get dashboard summary data"""
     
-    # Get latest cost snapshot
-    latest_snapshot = db.query(CostSnapshot).filter(
-        CostSnapshot.organization_id == current_user.organization_id
-    ).order_by(CostSnapshot.snapshot_date.desc()).first()
-    
-    # Get active recommendations
-    recommendations = db.query(Recommendation).filter(
-        Recommendation.organization_id == current_user.organization_id,
-        Recommendation.status == "active"
-    ).all()
-    
-    # Calculate totals
-    total_spend = latest_snapshot.total_cost if latest_snapshot else 0
-    potential_savings = sum(r.monthly_savings for r in recommendations)
+    async def compute():
+        summary = (await db.execute(DASHBOARD_SUMMARY, {
+            "org_id": current_user.organization_id
+        })).one()
+        
+        potential_savings = summary.potential_savings
+        total_spend = summary.total_cost or 0
+        has_snapshot = summary.snapshot_date is not None
+        
+        return {
+            'current_month_spend': total_spend,
+            'potential_monthly_savings': potential_savings,
+            'savings_percentage': (potential_savings / total_spend * 100) if total_spend > 0 else 0,
+            'active_recommendations': summary.active_count,
+            'top_recommendations': orjson.Fragment(summary.top_recommendations_json),
+            'service_breakdown': orjson.Fragment(summary.service_costs_json or 'null') if has_snapshot else {},
+            'last_analysis': summary.snapshot_date.isoformat() if has_snapshot else None
+        }
     
-    return {
-        'current_month_spend': total_spend,
-        'potential_monthly_savings': potential_savings,
-        'savings_percentage': (potential_savings / total_spend * 100) if total_spend > 0 else 0,
-        'active_recommendations': len(recommendations),
-        'top_recommendations': [
-            {
-                'title': r.title,
-                'savings': r.monthly_savings,
-                'risk': r.risk_level
-            }
-            for r in sorted(recommendations, key=lambda x: x.monthly_savings, reverse=True)[:5]
-        ],
-        'service_breakdown': latest_snapshot.service_costs if latest_snapshot else {},
-        'last_analysis': latest_snapshot.snapshot_date.isoformat() if latest_snapshot else None
-    }
+    key = DASHBOARD_KEY.format(org_id=current_user.organization_id)
+    body = await cached_json(key, DASHBOARD_CACHE_SECONDS, compute, lock=True)
+    return Response(content=body, media_type="application/json")
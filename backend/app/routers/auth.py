@@ -3,9 +3,12 @@ Authentication endpoints
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select, exists
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from pydantic import BaseModel, EmailStr
+import asyncio
+import logging
 import uuid
 
 from app.database import get_db
@@ -15,10 +18,13 @@ from app.utils.auth import (
     get_password_hash,
     create_access_token,
     get_current_user,
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    USER_BY_EMAIL
 )
+from app.tasks import update_last_login
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class UserSignup(BaseModel):
     email: EmailStr
@@ -38,11 +44,11 @@ class UserResponse(BaseModel):
     role: str
 
 @router.post("/signup", response_model=UserResponse)
-async def signup(user_data: UserSignup, db: Session = Depends(get_db)):
+async def signup(user_data: UserSignup, db: AsyncSession = Depends(get_db)):
     """Create a new user and organization"""
     
     # Check if user exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = await db.scalar(select(exists().where(User.email == user_data.email)))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -55,19 +61,22 @@ async def signup(user_data: UserSignup, db: Session = Depends(get_db)):
         email=user_data.email
     )
     db.add(org)
-    db.flush()  # Get org.id without committing
+    await db.flush()  # Get org.id without committing
+    
+    # bcrypt is deliberately slow; hash off the event loop
+    hashed_password = await asyncio.to_thread(get_password_hash, user_data.password)
     
     # Create user
     user = User(
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=hashed_password,
         full_name=user_data.full_name,
         organization_id=org.id,
         role="admin"  # First user is admin
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     return UserResponse(
         id=str(user.id),
@@ -80,22 +89,29 @@ async def signup(user_data: UserSignup, db: Session = Depends(get_db)):
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Login and receive access token"""
     
     # Find user
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await db.scalar(USER_BY_EMAIL, {"email": form_data.username})
+    if not user or not await asyncio.to_thread(verify_password, form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Update last login
-    user.last_login = datetime.utcnow()
-    db.commit()
+    # Record last login in the background so the response doesn't wait
+    # on the UPDATE; fall back to writing it here if the broker is down.
+    # Publishing blocks (with retries), so it runs off the event loop
+    login_time = datetime.utcnow()
+    try:
+        await asyncio.to_thread(update_last_login.delay, str(user.id), login_time.isoformat())
+    except Exception as e:
+        logger.warning(f"Could not queue last_login update: {str(e)}")
+        user.last_login = login_time
+        await db.commit()
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
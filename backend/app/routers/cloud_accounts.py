@@ -2,13 +2,20 @@
 Cloud account management endpoints
 """
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
+import asyncio
+import hashlib
+import hmac
 import logging
 
+from app.config import settings
 from app.database import get_db
+from app.cache import get_json, set_json, CONNECTION_TEST_KEY, CONNECTION_TEST_TTL
 from app.models.base import CloudAccount, Organization
 from app.utils.auth import get_current_user
 from app.utils.encryption import encrypt_credentials
@@ -32,14 +39,14 @@ class CloudAccountResponse(BaseModel):
     account_id: str
     account_name: str
     is_active: bool
-    last_sync: datetime = None
-    last_sync_status: str = None
+    last_sync: Optional[datetime] = None
+    last_sync_status: Optional[str] = None
 
 
 @router.post("/connect", response_model=CloudAccountResponse)
 async def connect_cloud_account(
     account_data: CloudAccountCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """Connect a new cloud account"""
@@ -51,8 +58,21 @@ async def connect_cloud_account(
             'secret_key': account_data.secret_key
         })
         
-        aws_service = AWSService(test_creds, account_data.region)
-        test_result = aws_service.test_connection()
+        # Reuse a recent successful permission check for the same credentials
+        fingerprint = hmac.new(
+            settings.secret_key.encode(),
+            f"{account_data.access_key}:{account_data.secret_key}:{account_data.region}".encode(),
+            hashlib.sha256
+        ).hexdigest()
+        cache_key = CONNECTION_TEST_KEY.format(fingerprint=fingerprint)
+        test_result = await get_json(cache_key)
+        
+        if test_result is None:
+            aws_service = AWSService(test_creds, account_data.region)
+            test_result = await asyncio.to_thread(aws_service.test_connection)
+            
+            if test_result['connected']:
+                await set_json(cache_key, test_result, CONNECTION_TEST_TTL)
         
         if not test_result['connected']:
             raise HTTPException(
@@ -66,10 +86,10 @@ async def connect_cloud_account(
         raise HTTPException(status_code=400, detail=f"Invalid credentials: {str(e)}")
     
     # Check if account already exists
-    existing = db.query(CloudAccount).filter(
+    existing = await db.scalar(select(exists().where(
         CloudAccount.account_id == account_id,
         CloudAccount.organization_id == current_user.organization_id
-    ).first()
+    )))
     
     if existing:
         raise HTTPException(status_code=400, detail="Account already connected")
@@ -85,8 +105,14 @@ async def connect_cloud_account(
     )
     
     db.add(cloud_account)
-    db.commit()
-    db.refresh(cloud_account)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent connect of the same account got past the check above
+        # and won the unique (organization_id, account_id) index
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Account already connected")
+    await db.refresh(cloud_account)
     
     return CloudAccountResponse(
         id=str(cloud_account.id),
@@ -101,14 +127,14 @@ async def connect_cloud_account(
 
 @router.get("/", response_model=List[CloudAccountResponse])
 async def list_cloud_accounts(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """List all cloud accounts for the organization"""
     
-    accounts = db.query(CloudAccount).filter(
+    accounts = (await db.scalars(select(CloudAccount).where(
         CloudAccount.organization_id == current_user.organization_id
-    ).all()
+    ))).all()
     
     return [
         CloudAccountResponse(
@@ -127,20 +153,20 @@ async def list_cloud_accounts(
 @router.delete("/{account_id}")
 async def disconnect_cloud_account(
     account_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """Disconnect a cloud account"""
     
-    account = db.query(CloudAccount).filter(
+    account = await db.scalar(select(CloudAccount).where(
         CloudAccount.id == account_id,
         CloudAccount.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
     
-    db.delete(account)
-    db.commit()
+    await db.delete(account)
+    await db.commit()
     
     return {"message": "Account disconnected successfully"}
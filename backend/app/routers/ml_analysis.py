@@ -2,89 +2,91 @@
 ML-enhanced analysis endpoints
 """
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime
+import asyncio
+import numpy as np
 
 from app.database import get_db
+from app.cache import get_json, COST_PREDICTION_KEY
 from app.models.base import CloudAccount
-from app.models.aws_resources import CostSnapshot
 from app.utils.auth import get_current_user
 from app.services.ml.cost_predictor import CostPredictor, ResourceUtilizationPredictor
 from app.services.aws_cost_explorer import AWSCostExplorer
+from app.tasks import train_cost_prediction
 
 router = APIRouter()
 
 
+async def _get_account(db: AsyncSession, cloud_account_id: str, organization_id) -> CloudAccount:
+    """Load a cloud account owned by the organization or raise 404"""
+    account = await db.scalar(select(CloudAccount).where(
+        CloudAccount.id == cloud_account_id,
+        CloudAccount.organization_id == organization_id
+    ))
+    
+    if not account:
+        raise HTTPException(status_code=404, detail="Cloud account not found")
+    
+    return account
+
+
+@router.post("/train")
+async def train_cost_model(
+    cloud_account_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """Retrain the cost prediction model for an account in the background"""
+    account = await _get_account(db, cloud_account_id, current_user.organization_id)
+    
+    # Publishing is a blocking broker round-trip, so keep it off the event loop
+    task = await asyncio.to_thread(train_cost_prediction.delay, str(account.id))
+    
+    return {'status': 'started', 'task_id': task.id}
+
+
 @router.get("/cost-prediction")
 async def get_cost_prediction(
     cloud_account_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    """Get ML-based cost predictions for the next 30 days"""
+    """
+    Get ML-based cost predictions for the next 30 days
+
+    Predictions are trained nightly (or via POST /train) by a Celery
+    worker; this only reads the cached result.
+    """
+    account = await _get_account(db, cloud_account_id, current_user.organization_id)
     
-    # Get historical cost data
-    snapshots = db.query(CostSnapshot).filter(
-        CostSnapshot.cloud_account_id == cloud_account_id,
-        CostSnapshot.organization_id == current_user.organization_id
-    ).order_by(CostSnapshot.snapshot_date.desc()).limit(90).all()
+    prediction = await get_json(COST_PREDICTION_KEY.format(account_id=account.id))
     
-    if len(snapshots) < 30:
+    if prediction is None:
         raise HTTPException(
-            status_code=400,
-            detail="Not enough historical data for prediction (need at least 30 days)"
+            status_code=404,
+            detail="No cost prediction available yet. Train one with POST /api/v1/ml/train"
         )
     
-    # Prepare data for training
-    historical_costs = [
-        {
-            'date': snapshot.snapshot_date.strftime('%Y-%m-%d'),
-            'cost': float(snapshot.total_cost)
-        }
-        for snapshot in reversed(snapshots)
-    ]
-    
-    # Train model and generate predictions
-    predictor = CostPredictor()
-    if predictor.train(historical_costs):
-        predictions = predictor.predict_next_days(30)
-        insights = predictor.get_cost_insights()
-        
-        # Detect anomalies in recent costs
-        recent_costs = historical_costs[-7:]  # Last 7 days
-        anomalies = predictor.detect_anomalies(recent_costs)
-        
-        return {
-            'predictions': predictions,
-            'anomalies': anomalies,
-            'insights': insights,
-            'historical_data': historical_costs[-30:],  # Last 30 days for chart
-        }
-    else:
-        raise HTTPException(status_code=500, detail="Failed to train prediction model")
+    return prediction
 
 
 @router.get("/anomaly-detection")
 async def detect_cost_anomalies(
     cloud_account_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """Detect anomalies in cloud spending using ML"""
     
     # Get cloud account
-    account = db.query(CloudAccount).filter(
-        CloudAccount.id == cloud_account_id,
-        CloudAccount.organization_id == current_user.organization_id
-    ).first()
+    account = await _get_account(db, cloud_account_id, current_user.organization_id)
     
-    if not account:
-        raise HTTPException(status_code=404, detail="Cloud account not found")
-    
-    # Get recent cost data from AWS
+    # Get recent cost data from AWS (blocking boto3 call, run off the event loop)
     cost_explorer = AWSCostExplorer(account.credentials_encrypted)
-    daily_costs = cost_explorer.get_daily_costs(90)  # Get 90 days for training
+    daily_costs = await asyncio.to_thread(cost_explorer.get_daily_costs, 90)  # Get 90 days for training
     
     if len(daily_costs) < 30:
         raise HTTPException(
@@ -93,8 +95,9 @@ async def detect_cost_anomalies(
         )
     
     # Train model
+    # Prophet training is CPU-bound; keep it off the event loop
     predictor = CostPredictor()
-    if predictor.train(daily_costs[:-7]):  # Train on all but last 7 days
+    if await asyncio.to_thread(predictor.train, daily_costs[:-7]):  # Train on all but last 7 days
         # Detect anomalies in last 7 days
         anomalies = predictor.detect_anomalies(daily_costs[-7:])
         
@@ -131,24 +134,22 @@ async def detect_cost_anomalies(
 async def predict_resource_utilization(
     resource_type: str,
     resource_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """Predict future utilization patterns for a resource"""
     
     # This would fetch actual CloudWatch metrics in production
     # For demo, we'll generate sample data
-    sample_data = [
-        {
-            'timestamp': (datetime.now() - timedelta(hours=i)).isoformat(),
-            'utilization': 30 + (i % 24) * 2 + (i % 168) * 0.5  # Simulate daily/weekly patterns
-        }
-        for i in range(720, 0, -1)  # 30 days of hourly data
-    ]
+    hours_ago = np.arange(720, 0, -1)  # 30 days of hourly data
+    sample_data = {
+        'timestamp': np.datetime64(datetime.now(), 's') - hours_ago.astype('timedelta64[h]'),
+        'utilization': 30 + (hours_ago % 24) * 2 + (hours_ago % 168) * 0.5  # Simulate daily/weekly patterns
+    }
     
     predictor = ResourceUtilizationPredictor()
-    if predictor.train_resource_model(resource_type, sample_data):
-        underutilized_periods = predictor.predict_underutilization(resource_type)
+    if await asyncio.to_thread(predictor.train_resource_model, resource_type, sample_data):
+        underutilized_periods = await asyncio.to_thread(predictor.predict_underutilization, resource_type)
         
         # Calculate potential savings
         hourly_cost = 0.1  # Example: $0.10/hour for the resource
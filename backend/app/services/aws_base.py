@@ -2,15 +2,56 @@
 Base AWS service class with authentication and common methods
 """
 import boto3
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Callable, Dict, Any, Iterable, Optional, List, Sequence
 from datetime import datetime, timedelta
+import hashlib
+import hmac
 import logging
-from botocore.exceptions import ClientError, NoCredentialsError
+import threading
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
 
+from app.cache import get_json_sync, set_json_sync, delete_pattern_sync, RESOURCE_LISTING_KEY, RESOURCE_LISTING_TTL
+from app.config import settings
 from app.utils.encryption import decrypt_credentials
 
 logger = logging.getLogger(__name__)
 
+# boto3 Sessions are not thread-safe, so client construction from a shared
+# session is serialized; the clients themselves are safe to share
+_client_lock = threading.Lock()
+
+# Building a client (endpoint resolution, service model loading) costs tens
+# of ms, so clients are shared process-wide by (credentials, service, region)
+# and later service instances for the same account reuse them. Bounded LRU
+MAX_CACHED_CLIENTS = 256
+_clients: "OrderedDict[tuple, Any]" = OrderedDict()
+
+# Failures an AWS call can raise (API errors, network/credential errors).
+# Analyzers catch only these so programming errors are not swallowed
+AWS_ERRORS = (BotoCoreError, ClientError)
+
+# Upper bound on concurrent per-resource AWS calls within one analyzer
+MAX_PARALLEL_CALLS = 16
+
+# One process-wide pool for those fan-outs, so threads are started once
+# rather than per call. Only leaf AWS calls are submitted to it (never work
+# that itself waits on the pool), so it cannot deadlock
+aws_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_CALLS, thread_name_prefix='aws')
+
+# Shared by every analyzer client: a connection pool larger than the
+# thread fan-out (analyzers run concurrently on one session), adaptive
+# retries to absorb throttling bursts, and bounded timeouts
+CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    connect_timeout=5,
+    read_timeout=30
+)
+
 
 class AWSService:
     """Base class for AWS service integration"""
@@ -29,18 +70,112 @@ class AWSService:
             )
             
             self.region = region
-            self.account_id = self._get_account_id()
+            self._account_id = None
             
         except Exception as e:
             logger.error(f"Failed to initialize AWS service: {str(e)}")
             raise
     
+    @classmethod
+    def from_session(cls, session: boto3.Session, account_id: Optional[str] = None):
+        """
+        Build a service on an already-authenticated session.
+        
+        Lets several analyzers share one credential decryption and one
+        boto3 Session instead of each rebuilding them.
+        """
+        service = cls.__new__(cls)
+        service.session = session
+        service.region = session.region_name
+        service._account_id = account_id
+        return service
+    
+    @cached_property
+    def _cache_scope(self) -> str:
+        """Per-credential cache namespace (HMAC of the access key id)"""
+        access_key = self.session.get_credentials().access_key
+        return hmac.new(settings.secret_key.encode(), access_key.encode(), hashlib.sha256).hexdigest()[:32]
+    
+    def _cached_listing(
+        self,
+        listing: str,
+        fetch: Callable[[], Iterable[Dict[str, Any]]],
+        datetime_fields: Sequence[str] = ()
+    ) -> List[Dict[str, Any]]:
+        """
+        Return a resource listing, shared through Redis for RESOURCE_LISTING_TTL.
+        
+        Repeat analyses of the same account and region within the TTL skip
+        the describe round-trips. Items must be JSON-serializable apart from
+        `datetime_fields`, which are restored from ISO strings on a hit.
+        """
+        key = RESOURCE_LISTING_KEY.format(listing=listing, scope=self._cache_scope, region=self.region)
+        
+        cached = get_json_sync(key)
+        if cached is not None:
+            for item in cached:
+                for field in datetime_fields:
+                    if item.get(field):
+                        item[field] = datetime.fromisoformat(item[field])
+            return cached
+        
+        items = list(fetch())
+        set_json_sync(key, items, RESOURCE_LISTING_TTL)
+        return items
+    
+    def invalidate_listings(self) -> None:
+        """Drop cached resource listings for these credentials and region"""
+        delete_pattern_sync(RESOURCE_LISTING_KEY.format(listing='*', scope=self._cache_scope, region=self.region))
+    
+    @cached_property
+    def _credentials_fingerprint(self) -> str:
+        """HMAC of the full credential set, so rotated keys get new clients"""
+        creds = self.session.get_credentials().get_frozen_credentials()
+        material = f"{creds.access_key}:{creds.secret_key}:{creds.token or ''}"
+        return hmac.new(settings.secret_key.encode(), material.encode(), hashlib.sha256).hexdigest()
+    
+    def _client(self, service_name: str, region: Optional[str] = None):
+        key = (self._credentials_fingerprint, service_name, region or self.region)
+        with _client_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = self.session.client(service_name, region_name=key[2], config=CLIENT_CONFIG)
+                _clients[key] = client
+                if len(_clients) > MAX_CACHED_CLIENTS:
+                    _clients.popitem(last=False)
+            else:
+                _clients.move_to_end(key)
+            return client
+    
+    @cached_property
+    def ec2_client(self):
+        return self._client('ec2')
+    
+    @cached_property
+    def cw_client(self):
+        return self._client('cloudwatch')
+    
+    @cached_property
+    def s3_client(self):
+        return self._client('s3')
+    
+    @cached_property
+    def ce_client(self):
+        return self._client('ce', 'us-east-1')  # CE is only in us-east-1
+    
+    @property
+    def account_id(self) -> str:
+        """AWS account ID, looked up via STS on first access only"""
+        if self._account_id is None:
+            self._account_id = self._get_account_id()
+        return self._account_id
+    
     def _get_account_id(self) -> str:
         """Get AWS account ID"""
         try:
-            sts = self.session.client('sts')
+            sts = self._client('sts')
             return sts.get_caller_identity()['Account']
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to get account ID: {str(e)}")
             return "unknown"
     
@@ -55,10 +190,10 @@ class AWSService:
         
         try:
             # Test STS (basic connectivity)
-            sts = self.session.client('sts')
+            sts = self._client('sts')
             identity = sts.get_caller_identity()
             results['connected'] = True
-            results['account_id'] = identity['Account']
+            results['account_id'] = self._account_id = identity['Account']
             
             # Test required permissions
             permission_tests = [
@@ -68,9 +203,17 @@ class AWSService:
                 ('rds:DescribeDBInstances', self._test_rds_permissions),
             ]
             
-            for permission, test_func in permission_tests:
+            # The probes are independent round-trips, so run them all at
+            # once; wall time is the slowest probe rather than the sum.
+            # Only reached once STS succeeded (a failure above skips them)
+            futures = [
+                (permission, aws_executor.submit(test_func))
+                for permission, test_func in permission_tests
+            ]
+            
+            for permission, future in futures:
                 try:
-                    test_func()
+                    future.result()
                     results['permissions'][permission] = True
                 except ClientError as e:
                     results['permissions'][permission] = False
@@ -83,15 +226,13 @@ class AWSService:
     
     def _test_ec2_permissions(self):
         """Test EC2 permissions"""
-        ec2 = self.session.client('ec2')
-        ec2.describe_instances(MaxResults=1)
+        self.ec2_client.describe_instances(MaxResults=5)
     
     def _test_cost_explorer_permissions(self):
         """Test Cost Explorer permissions"""
-        ce = self.session.client('ce')
         end = datetime.now().date()
         start = end - timedelta(days=1)
-        ce.get_cost_and_usage(
+        self.ce_client.get_cost_and_usage(
             TimePeriod={'Start': start.isoformat(), 'End': end.isoformat()},
             Granularity='DAILY',
             Metrics=['UnblendedCost']
@@ -99,10 +240,8 @@ class AWSService:
     
     def _test_cloudwatch_permissions(self):
         """Test CloudWatch permissions"""
-        cw = self.session.client('cloudwatch')
-        cw.list_metrics(MaxResults=1)
+        self.cw_client.list_metrics(Namespace='AWS/EC2')
     
     def _test_rds_permissions(self):
         """Test RDS permissions"""
-        rds = self.session.client('rds')
-        rds.describe_db_instances(MaxRecords=20)
+        self._client('rds').describe_db_instances(MaxRecords=20)
@@ -2,11 +2,16 @@
 AWS Cost Explorer service for cost analysis
 """
 from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta, date
+from datetime import timedelta, date
+import hashlib
 import logging
-from decimal import Decimal
 
-from app.services.aws_base import AWSService
+import numpy as np
+import orjson
+
+from app.cache import get_json_sync, set_json_sync, delete_pattern_sync, CE_RESPONSE_KEY, CE_RESPONSE_TTL
+from app.services.aws_base import AWSService, AWS_ERRORS
+from app.services.kernels import spike_indices, top_k_sums
 
 logger = logging.getLogger(__name__)
 
@@ -14,24 +19,73 @@ logger = logging.getLogger(__name__)
 class AWSCostExplorer(AWSService):
     """AWS Cost Explorer service for fetching cost data"""
     
-    def __init__(self, encrypted_credentials: str, region: str = 'us-east-1'):
-        super().__init__(encrypted_credentials, region)
-        self.ce_client = self.session.client('ce', region_name='us-east-1')  # CE is only in us-east-1
+    @staticmethod
+    def _request(
+        days: int,
+        granularity: str,
+        metrics: List[str],
+        group_by: Optional[List[Dict[str, str]]] = None,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Build GetCostAndUsage kwargs for the `days` days ending today.
+        
+        Every method goes through here so identical queries produce identical
+        kwargs (and so the same cache key); unused options are omitted.
+        """
+        end = date.today()
+        start = end - timedelta(days=days)
+        params = {
+            'TimePeriod': {'Start': start.isoformat(), 'End': end.isoformat()},
+            'Granularity': granularity,
+            'Metrics': metrics
+        }
+        if group_by:
+            params['GroupBy'] = group_by
+        if filter:
+            params['Filter'] = filter
+        return params
+    
+    def _ce_call(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        GetCostAndUsage through a shared Redis TTL cache.
+        
+        Identical requests for the same credentials within CE_RESPONSE_TTL
+        are answered from the cache instead of a billed API call.
+        """
+        request = hashlib.sha256(
+            orjson.dumps({'op': 'GetCostAndUsage', 'params': params}, option=orjson.OPT_SORT_KEYS)
+        ).hexdigest()
+        key = CE_RESPONSE_KEY.format(scope=self._cache_scope, request=request)
+        
+        cached = get_json_sync(key)
+        if cached is not None:
+            return cached
+        
+        # CE has no paginator; grouped results are split across NextPageToken pages
+        response = self.ce_client.get_cost_and_usage(**params)
+        while response.get('NextPageToken'):
+            page = self.ce_client.get_cost_and_usage(**params, NextPageToken=response.pop('NextPageToken'))
+            response['ResultsByTime'].extend(page['ResultsByTime'])
+            response['NextPageToken'] = page.get('NextPageToken')
+        response.pop('NextPageToken', None)
+        response.pop('ResponseMetadata', None)
+        set_json_sync(key, response, CE_RESPONSE_TTL)
+        return response
+    
+    def invalidate(self) -> None:
+        """Drop every cached Cost Explorer response for these credentials"""
+        delete_pattern_sync(CE_RESPONSE_KEY.format(scope=self._cache_scope, request='*'))
     
     def get_current_month_spend(self) -> Dict[str, Any]:
         """Get current month's spend to date"""
         try:
-            today = date.today()
-            start = today.replace(day=1)
-            
-            response = self.ce_client.get_cost_and_usage(
-                TimePeriod={
-                    'Start': start.isoformat(),
-                    'End': today.isoformat()
-                },
-                Granularity='MONTHLY',
-                Metrics=['UnblendedCost', 'UsageQuantity']
-            )
+            # Month to date: from the 1st through today
+            response = self._ce_call(self._request(
+                days=date.today().day - 1,
+                granularity='MONTHLY',
+                metrics=['UnblendedCost', 'UsageQuantity']
+            ))
             
             if response['ResultsByTime']:
                 result = response['ResultsByTime'][0]
@@ -44,57 +98,41 @@ class AWSCostExplorer(AWSService):
             
             return {'total': 0.0, 'currency': 'USD'}
             
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to get current month spend: {str(e)}")
             return {'error': str(e)}
     
     def get_daily_costs(self, days: int = 30) -> List[Dict[str, Any]]:
         """Get daily costs for the past N days"""
         try:
-            end = date.today()
-            start = end - timedelta(days=days)
-            
-            response = self.ce_client.get_cost_and_usage(
-                TimePeriod={
-                    'Start': start.isoformat(),
-                    'End': end.isoformat()
-                },
-                Granularity='DAILY',
-                Metrics=['UnblendedCost']
-            )
-            
-            daily_costs = []
-            for result in response['ResultsByTime']:
-                daily_costs.append({
+            response = self._ce_call(self._request(
+                days=days,
+                granularity='DAILY',
+                metrics=['UnblendedCost']
+            ))
+            
+            return [
+                {
                     'date': result['TimePeriod']['Start'],
                     'cost': float(result['Total']['UnblendedCost']['Amount']),
                     'currency': result['Total']['UnblendedCost']['Unit']
-                })
-            
-            return daily_costs
+                }
+                for result in response['ResultsByTime']
+            ]
             
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to get daily costs: {str(e)}")
             return []
     
     def get_service_costs(self, days: int = 30) -> Dict[str, float]:
         """Get costs broken down by service"""
         try:
-            end = date.today()
-            start = end - timedelta(days=days)
-            
-            response = self.ce_client.get_cost_and_usage(
-                TimePeriod={
-                    'Start': start.isoformat(),
-                    'End': end.isoformat()
-                },
-                Granularity='MONTHLY',
-                Metrics=['UnblendedCost'],
-                GroupBy=[{
-                    'Type': 'DIMENSION',
-                    'Key': 'SERVICE'
-                }]
-            )
+            response = self._ce_call(self._request(
+                days=days,
+                granularity='MONTHLY',
+                metrics=['UnblendedCost'],
+                group_by=[{'Type': 'DIMENSION', 'Key': 'SERVICE'}]
+            ))
             
             service_costs = {}
             if response['ResultsByTime']:
@@ -106,17 +144,17 @@ class AWSCostExplorer(AWSService):
             
             return service_costs
             
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to get service costs: {str(e)}")
             return {}
     
     def get_top_cost_resources(self, service: str = None, limit: int = 10) -> List[Dict[str, Any]]:
         """Get top cost resources, optionally filtered by service"""
         try:
-            end = date.today()
-            start = end - timedelta(days=7)  # Last 7 days for more recent data
-            
-            filters = {}
+            # A service filter makes the SERVICE dimension redundant; grouping
+            # by USAGE_TYPE alone keeps the (billed, paginated) result small
+            group_by = [{'Type': 'DIMENSION', 'Key': 'USAGE_TYPE'}]
+            filters = None
             if service:
                 filters = {
                     'Dimensions': {
@@ -124,72 +162,67 @@ class AWSCostExplorer(AWSService):
                         'Values': [service]
                     }
                 }
-            
-            response = self.ce_client.get_cost_and_usage(
-                TimePeriod={
-                    'Start': start.isoformat(),
-                    'End': end.isoformat()
-                },
-                Granularity='DAILY',
-                Metrics=['UnblendedCost'],
-                GroupBy=[
-                    {'Type': 'DIMENSION', 'Key': 'USAGE_TYPE'},
-                    {'Type': 'DIMENSION', 'Key': 'SERVICE'}
-                ],
-                Filter=filters if filters else None
+            else:
+                group_by.append({'Type': 'DIMENSION', 'Key': 'SERVICE'})
+            
+            response = self._ce_call(self._request(
+                days=7,  # Last 7 days for more recent data
+                granularity='DAILY',
+                metrics=['UnblendedCost'],
+                group_by=group_by,
+                filter=filters
+            ))
+            
+            groups = [group for day in response['ResultsByTime'] for group in day['Groups']]
+            if not groups or limit <= 0:
+                return []
+            
+            # Columnar aggregation by resource, then top-`limit` selection
+            if service:
+                keys = np.array([f"{service}::{group['Keys'][0]}" for group in groups])
+            else:
+                keys = np.array([f"{group['Keys'][1]}::{group['Keys'][0]}" for group in groups])  # SERVICE::USAGE_TYPE
+            amounts = np.array(
+                [group['Metrics']['UnblendedCost']['Amount'] for group in groups],
+                dtype=np.float64
             )
+            resources, costs = top_k_sums(keys, amounts, limit)
             
-            # Aggregate costs by resource
-            resource_costs = {}
-            for day in response['ResultsByTime']:
-                for group in day['Groups']:
-                    key = f"{group['Keys'][1]}::{group['Keys'][0]}"  # SERVICE::USAGE_TYPE
-                    cost = float(group['Metrics']['UnblendedCost']['Amount'])
-                    resource_costs[key] = resource_costs.get(key, 0) + cost
+            return [
+                {'resource': str(resource), 'cost': float(cost)}
+                for resource, cost in zip(resources, costs)
+            ]
             
-            # Sort and limit
-            top_resources = sorted(
-                [{'resource': k, 'cost': v} for k, v in resource_costs.items()],
-                key=lambda x: x['cost'],
-                reverse=True
-            )[:limit]
-            
-            return top_resources
-            
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to get top cost resources: {str(e)}")
             return []
     
-    def detect_cost_anomalies(self, threshold_percent: float = 20) -> List[Dict[str, Any]]:
-        """Detect cost spikes and anomalies"""
+    def detect_cost_anomalies(self, threshold_percent: float = 20, window: int = 3) -> List[Dict[str, Any]]:
+        """Detect cost spikes against a trailing `window`-day moving average"""
         anomalies = []
         
         try:
-            daily_costs = self.get_daily_costs(14)  # Get 2 weeks of data
+            daily_costs = self.get_daily_costs(max(14, window * 2))  # At least 2 weeks of data
             
-            if len(daily_costs) < 3:
+            if len(daily_costs) <= window:
                 return anomalies
             
-            # Calculate moving average
-            for i in range(3, len(daily_costs)):
-                current_cost = daily_costs[i]['cost']
-                # Average of previous 3 days
-                avg_cost = sum(daily_costs[j]['cost'] for j in range(i-3, i)) / 3
-                
-                if avg_cost > 0:
-                    percent_change = ((current_cost - avg_cost) / avg_cost) * 100
-                    
-                    if percent_change > threshold_percent:
-                        anomalies.append({
-                            'date': daily_costs[i]['date'],
-                            'cost': current_cost,
-                            'expected_cost': avg_cost,
-                            'percent_increase': percent_change,
-                            'severity': 'high' if percent_change > 50 else 'medium'
-                        })
+            costs = np.fromiter((day['cost'] for day in daily_costs), dtype=np.float64, count=len(daily_costs))
+            
+            indices, expected, percent_change = spike_indices(costs, window, threshold_percent)
+            
+            for i in indices:
+                k = i - window  # position in the aligned baseline arrays
+                anomalies.append({
+                    'date': daily_costs[i]['date'],
+                    'cost': float(costs[i]),
+                    'expected_cost': float(expected[k]),
+                    'percent_increase': float(percent_change[k]),
+                    'severity': 'high' if percent_change[k] > 50 else 'medium'
+                })
             
             return anomalies
             
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to detect anomalies: {str(e)}")
             return []
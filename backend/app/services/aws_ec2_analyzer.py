@@ -1,49 +1,56 @@
 """
 EC2 instance analyzer for finding optimization opportunities
 """
-from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
+from types import MappingProxyType
+from typing import Dict, Any, Iterator, List, Optional
+from datetime import datetime, timedelta, timezone
 import logging
 
-from app.services.aws_base import AWSService
+import numpy as np
+
+from app.services.aws_base import AWSService, AWS_ERRORS
 
 logger = logging.getLogger(__name__)
 
+# Simplified pricing (in production, use AWS Pricing API); read-only and
+# shared by every analyzer instance
+_INSTANCE_HOURLY_PRICING = MappingProxyType({
+    't2.micro': 0.0116, 't2.small': 0.023, 't2.medium': 0.0464,
+    't2.large': 0.0928, 't2.xlarge': 0.1856, 't2.2xlarge': 0.3712,
+    't3.micro': 0.0104, 't3.small': 0.0208, 't3.medium': 0.0416,
+    't3.large': 0.0832, 't3.xlarge': 0.1664, 't3.2xlarge': 0.3328,
+    'm5.large': 0.096, 'm5.xlarge': 0.192, 'm5.2xlarge': 0.384,
+    'c5.large': 0.085, 'c5.xlarge': 0.17, 'c5.2xlarge': 0.34,
+})
+
+# GetMetricData accepts up to 500 queries per request; two per instance
+UTILIZATION_BATCH_SIZE = 250
+
 
 class EC2Analyzer(AWSService):
     """Analyze EC2 instances for cost optimization"""
     
-    def __init__(self, encrypted_credentials: str, region: str = 'us-east-1'):
-        super().__init__(encrypted_credentials, region)
-        self.ec2_client = self.session.client('ec2', region_name=region)
-        self.cw_client = self.session.client('cloudwatch', region_name=region)
+    def iter_instances(self) -> Iterator[Dict[str, Any]]:
+        """Yield parsed EC2 instances (listing cached briefly, see _cached_listing)"""
+        return iter(self._cached_listing('ec2-instances', self._list_instances, ('launch_time',)))
+    
+    def _list_instances(self) -> Iterator[Dict[str, Any]]:
+        """Yield parsed EC2 instances page by page"""
+        paginator = self.ec2_client.get_paginator('describe_instances')
         
-        # Simplified pricing (in production, use AWS Pricing API)
-        self.instance_hourly_pricing = {
-            't2.micro': 0.0116, 't2.small': 0.023, 't2.medium': 0.0464,
-            't2.large': 0.0928, 't2.xlarge': 0.1856, 't2.2xlarge': 0.3712,
-            't3.micro': 0.0104, 't3.small': 0.0208, 't3.medium': 0.0416,
-            't3.large': 0.0832, 't3.xlarge': 0.1664, 't3.2xlarge': 0.3328,
-            'm5.large': 0.096, 'm5.xlarge': 0.192, 'm5.2xlarge': 0.384,
-            'c5.large': 0.085, 'c5.xlarge': 0.17, 'c5.2xlarge': 0.34,
-        }
+        # Largest page EC2 allows; search() flattens reservations as it streams
+        pages = paginator.paginate(PaginationConfig={'PageSize': 1000})
+        for instance in pages.search('Reservations[].Instances[]'):
+            yield self._parse_instance(instance)
     
     def get_all_instances(self) -> List[Dict[str, Any]]:
         """Get all EC2 instances in the region"""
-        instances = []
-        
         try:
-            paginator = self.ec2_client.get_paginator('describe_instances')
-            
-            for page in paginator.paginate():
-                for reservation in page['Reservations']:
-                    for instance in reservation['Instances']:
-                        instances.append(self._parse_instance(instance))
-            
+            instances = list(self.iter_instances())
             logger.info(f"Found {len(instances)} EC2 instances")
             return instances
             
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to get instances: {str(e)}")
             return []
     
@@ -53,25 +60,21 @@ class EC2Analyzer(AWSService):
         state = instance['State']['Name']
         
         # Calculate monthly cost
-        hourly_cost = self.instance_hourly_pricing.get(instance_type, 0.1)  # Default $0.1/hour
+        hourly_cost = _INSTANCE_HOURLY_PRICING.get(instance_type, 0.1)  # Default $0.1/hour
         monthly_cost = hourly_cost * 730  # Average hours per month
         
-        # Get name tag
-        name = 'Unnamed'
-        for tag in instance.get('Tags', []):
-            if tag['Key'] == 'Name':
-                name = tag['Value']
-                break
+        # Build the tag dict once; the Name tag is a lookup into it
+        tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', ())}
         
         return {
             'instance_id': instance['InstanceId'],
-            'name': name,
+            'name': tags.get('Name', 'Unnamed'),
             'type': instance_type,
             'state': state,
             'launch_time': instance.get('LaunchTime'),
             'region': self.region,
             'availability_zone': instance.get('Placement', {}).get('AvailabilityZone'),
-            'tags': {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])},
+            'tags': tags,
             'hourly_cost': hourly_cost,
             'monthly_cost': monthly_cost,
             'vpc_id': instance.get('VpcId'),
@@ -83,7 +86,7 @@ class EC2Analyzer(AWSService):
     def analyze_instance_utilization(self, instance_id: str, days: int = 7) -> Dict[str, Any]:
         """Analyze CPU utilization for an instance"""
         try:
-            end_time = datetime.utcnow()
+            end_time = datetime.now(timezone.utc)
             start_time = end_time - timedelta(days=days)
             
             response = self.cw_client.get_metric_statistics(
@@ -109,67 +112,197 @@ class EC2Analyzer(AWSService):
                 'data_points': len(datapoints)
             }
             
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to get utilization for {instance_id}: {str(e)}")
             return {'average': None, 'maximum': None, 'error': str(e)}
     
-    def find_optimization_opportunities(self) -> List[Dict[str, Any]]:
-        """Find EC2 optimization opportunities"""
-        recommendations = []
+    def get_utilization_batch(self, instance_ids: List[str], days: int = 7) -> Dict[str, Dict[str, Any]]:
+        """
+        CPU utilization for many instances via batched GetMetricData.
         
-        try:
-            instances = self.get_all_instances()
+        Returns the same shape as analyze_instance_utilization, keyed by
+        instance id, using ceil(N / UTILIZATION_BATCH_SIZE) requests
+        instead of one get_metric_statistics call per instance.
+        """
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(days=days)
+        utilization = {}
+        
+        for offset in range(0, len(instance_ids), UTILIZATION_BATCH_SIZE):
+            batch = instance_ids[offset:offset + UTILIZATION_BATCH_SIZE]
+            
+            queries = []
+            for i, instance_id in enumerate(batch):
+                metric = {
+                    'Namespace': 'AWS/EC2',
+                    'MetricName': 'CPUUtilization',
+                    'Dimensions': [{'Name': 'InstanceId', 'Value': instance_id}]
+                }
+                for stat in ('Average', 'Maximum'):
+                    queries.append({
+                        'Id': f"{stat.lower()}{i}",
+                        'MetricStat': {'Metric': metric, 'Period': 3600, 'Stat': stat},  # 1 hour intervals
+                        'ReturnData': True
+                    })
             
-            for instance in instances:
-                # Check stopped instances
-                if instance['state'] == 'stopped':
-                    if instance.get('launch_time'):
-                        stopped_days = (datetime.now(instance['launch_time'].tzinfo) - instance['launch_time']).days
-                        if stopped_days > 7:
-                            recommendations.append({
-                                'type': 'terminate_stopped',
-                                'resource_id': instance['instance_id'],
-                                'resource_name': instance['name'],
-                                'reason': f"Instance stopped for {stopped_days} days",
-                                'monthly_savings': instance['monthly_cost'],
-                                'risk': 'low',
-                                'action': 'Terminate instance or create AMI backup',
-                                'confidence': 0.9
-                            })
+            try:
+                values = {query['Id']: [] for query in queries}
+                paginator = self.cw_client.get_paginator('get_metric_data')
+                for page in paginator.paginate(
+                    MetricDataQueries=queries,
+                    StartTime=start_time,
+                    EndTime=end_time,
+                    ScanBy='TimestampDescending'
+                ):
+                    for result in page['MetricDataResults']:
+                        values[result['Id']].extend(result['Values'])
                 
-                # Check running instances for low utilization
-                elif instance['state'] == 'running':
-                    utilization = self.analyze_instance_utilization(instance['instance_id'])
+                for i, instance_id in enumerate(batch):
+                    averages = values[f"average{i}"]
+                    maximums = values[f"maximum{i}"]
                     
-                    if utilization.get('average') is not None and utilization['average'] < 10:
-                        recommendations.append({
-                            'type': 'low_utilization',
-                            'resource_id': instance['instance_id'],
-                            'resource_name': instance['name'],
-                            'reason': f"Average CPU utilization only {utilization['average']}%",
-                            'current_type': instance['type'],
-                            'monthly_savings': instance['monthly_cost'] * 0.5,  # Assume 50% savings
-                            'risk': 'medium',
-                            'action': 'Downsize or terminate instance',
-                            'confidence': 0.7,
-                            'metrics': utilization
-                        })
+                    if not averages:
+                        utilization[instance_id] = {'average': 0, 'maximum': 0, 'data_points': 0}
+                        continue
                     
-                    # Check for instances without tags (poor governance)
-                    if len(instance.get('tags', {})) < 2:
-                        recommendations.append({
-                            'type': 'governance',
-                            'resource_id': instance['instance_id'],
-                            'resource_name': instance['name'],
-                            'reason': 'Instance lacks proper tagging',
-                            'risk': 'none',
-                            'action': 'Add tags: Environment, Owner, Project',
-                            'confidence': 1.0
-                        })
+                    utilization[instance_id] = {
+                        'average': round(sum(averages) / len(averages), 2),
+                        'maximum': round(max(maximums), 2) if maximums else 0,
+                        'data_points': len(averages)
+                    }
+                    
+            except AWS_ERRORS as e:
+                logger.error(f"Failed to get utilization for {len(batch)} instances: {str(e)}")
+                for instance_id in batch:
+                    utilization[instance_id] = {'average': None, 'maximum': None, 'error': str(e)}
+        
+        return utilization
+    
+    def analyze_instances(self) -> Dict[str, Any]:
+        """
+        Count, cost and check every instance in a single pass.
+        
+        Instances are classified in batches: one CloudWatch lookup for the
+        batch's running instances (see get_utilization_batch), then the
+        checks are applied as array masks over the whole batch.
+        """
+        results = {
+            'total_instances': 0,
+            'total_monthly_cost': 0.0,
+            'opportunities': [],
+            'potential_savings': 0.0
+        }
+        
+        try:
+            batch = []
+            for instance in self.iter_instances():
+                batch.append(instance)
+                if len(batch) == UTILIZATION_BATCH_SIZE:
+                    self._classify_batch(results, batch)
+                    batch = []
             
-            logger.info(f"Found {len(recommendations)} optimization opportunities")
-            return recommendations
+            if batch:
+                self._classify_batch(results, batch)
             
-        except Exception as e:
-            logger.error(f"Failed to find opportunities: {str(e)}")
-            return []
+            logger.info(
+                f"Found {results['total_instances']} EC2 instances and "
+                f"{len(results['opportunities'])} optimization opportunities"
+            )
+            return results
+            
+        except AWS_ERRORS as e:
+            logger.error(f"Failed to analyze instances: {str(e)}")
+            return results
+    
+    def find_optimization_opportunities(self) -> List[Dict[str, Any]]:
+        """Find EC2 optimization opportunities"""
+        return self.analyze_instances()['opportunities']
+    
+    def _classify_batch(self, results: Dict[str, Any], instances: List[Dict[str, Any]]):
+        """Add a batch's totals and optimization opportunities to `results`"""
+        count = len(instances)
+        states = np.array([instance['state'] for instance in instances])
+        monthly_costs = np.fromiter((instance['monthly_cost'] for instance in instances), dtype=np.float64, count=count)
+        tag_counts = np.fromiter((len(instance.get('tags', {})) for instance in instances), dtype=np.int64, count=count)
+        # One "now" for the whole batch; boto3 launch times are tz-aware UTC
+        now = datetime.now(timezone.utc)
+        stopped_days = np.fromiter(
+            (self._days_since(instance.get('launch_time'), now) for instance in instances), dtype=np.int64, count=count
+        )
+        
+        running = states == 'running'
+        utilization = self.get_utilization_batch(
+            [instances[i]['instance_id'] for i in np.flatnonzero(running)]
+        ) if running.any() else {}
+        cpu_average = np.fromiter(
+            (self._average_or_nan(utilization.get(instance['instance_id'])) for instance in instances),
+            dtype=np.float64,
+            count=count
+        )
+        
+        # The checks, as masks over the batch (NaN averages never match)
+        stale_stopped = (states == 'stopped') & (stopped_days > 7)
+        low_utilization = running & (cpu_average < 10)
+        untagged = running & (tag_counts < 2)  # poor governance
+        
+        results['total_instances'] += count
+        results['total_monthly_cost'] += float(monthly_costs.sum())
+        
+        for i in np.flatnonzero(stale_stopped | low_utilization | untagged):
+            instance = instances[i]
+            opportunities = []
+            
+            if stale_stopped[i]:
+                opportunities.append({
+                    'type': 'terminate_stopped',
+                    'resource_id': instance['instance_id'],
+                    'resource_name': instance['name'],
+                    'reason': f"Instance stopped for {stopped_days[i]} days",
+                    'monthly_savings': instance['monthly_cost'],
+                    'risk': 'low',
+                    'action': 'Terminate instance or create AMI backup',
+                    'confidence': 0.9
+                })
+            
+            if low_utilization[i]:
+                metrics = utilization[instance['instance_id']]
+                opportunities.append({
+                    'type': 'low_utilization',
+                    'resource_id': instance['instance_id'],
+                    'resource_name': instance['name'],
+                    'reason': f"Average CPU utilization only {metrics['average']}%",
+                    'current_type': instance['type'],
+                    'monthly_savings': instance['monthly_cost'] * 0.5,  # Assume 50% savings
+                    'risk': 'medium',
+                    'action': 'Downsize or terminate instance',
+                    'confidence': 0.7,
+                    'metrics': metrics
+                })
+            
+            if untagged[i]:
+                opportunities.append({
+                    'type': 'governance',
+                    'resource_id': instance['instance_id'],
+                    'resource_name': instance['name'],
+                    'reason': 'Instance lacks proper tagging',
+                    'risk': 'none',
+                    'action': 'Add tags: Environment, Owner, Project',
+                    'confidence': 1.0
+                })
+            
+            for opportunity in opportunities:
+                results['opportunities'].append(opportunity)
+                results['potential_savings'] += opportunity.get('monthly_savings', 0)
+    
+    @staticmethod
+    def _days_since(launch_time: Optional[datetime], now: datetime) -> int:
+        """Whole days from `launch_time` to `now`, or -1 when unknown"""
+        if not launch_time:
+            return -1
+        return (now - launch_time).days
+    
+    @staticmethod
+    def _average_or_nan(metrics: Optional[Dict[str, Any]]) -> float:
+        if not metrics or metrics.get('average') is None:
+            return np.nan
+        return metrics['average']
@@ -1,24 +1,37 @@
 """
 Analyze AWS storage services (EBS, S3) for optimization
 """
-from typing import Dict, Any, List
-from datetime import datetime, timedelta
+from types import MappingProxyType
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 import logging
 
-from app.services.aws_base import AWSService
+import numpy as np
+from botocore.exceptions import ClientError
+
+from app.services.aws_base import AWSService, AWS_ERRORS, aws_executor
+from app.services.kernels import lookup_prices
 
 logger = logging.getLogger(__name__)
 
+# GetMetricData accepts up to 500 queries per request; one per bucket
+BUCKET_METRICS_BATCH_SIZE = 500
+
+# Simplified EBS pricing per GB-month (actual prices vary by region)
+_EBS_GB_MONTH_PRICING = MappingProxyType({
+    'gp3': 0.08,
+    'gp2': 0.10,
+    'io1': 0.125,
+    'io2': 0.125,
+    'st1': 0.045,
+    'sc1': 0.025,
+    'standard': 0.05
+})
+
 
 class StorageAnalyzer(AWSService):
     """Analyze storage resources for cost optimization"""
     
-    def __init__(self, encrypted_credentials: str, region: str = 'us-east-1'):
-        super().__init__(encrypted_credentials, region)
-        self.ec2_client = self.session.client('ec2', region_name=region)
-        self.s3_client = self.session.client('s3')
-        self.cw_client = self.session.client('cloudwatch', region_name=region)
-    
     def analyze_ebs_volumes(self) -> Dict[str, Any]:
         """Analyze EBS volumes for optimization"""
         results = {
@@ -31,24 +44,36 @@ class StorageAnalyzer(AWSService):
         }
         
         try:
-            response = self.ec2_client.describe_volumes()
-            volumes = response['Volumes']
-            
+            volumes = self._cached_listing('ebs-volumes', self._list_volumes, ('CreateTime',))
             results['total_volumes'] = len(volumes)
             
-            for volume in volumes:
-                size_gb = volume['Size']
-                volume_type = volume['VolumeType']
-                state = volume['State']
-                
-                results['total_size_gb'] += size_gb
-                
-                # Calculate cost (simplified)
-                monthly_cost = self._calculate_ebs_cost(size_gb, volume_type)
-                results['total_monthly_cost'] += monthly_cost
+            if not volumes:
+                return results
+            
+            # Column arrays (one per field) so costs and checks are computed
+            # for every volume at once
+            sizes = np.fromiter((volume['Size'] for volume in volumes), dtype=np.int64, count=len(volumes))
+            types = np.array([volume['VolumeType'] for volume in volumes])
+            states = np.array([volume['State'] for volume in volumes])
+            
+            monthly_costs = self._calculate_ebs_costs(sizes, types)
+            gp3_savings = monthly_costs - self._calculate_ebs_costs(sizes, np.full(len(volumes), 'gp3'))
+            
+            results['total_size_gb'] = int(sizes.sum())
+            results['total_monthly_cost'] = float(monthly_costs.sum())
+            
+            # Unattached volumes, and large gp2 volumes worth moving to gp3
+            # (only if saving > $5/month)
+            unattached = states == 'available'
+            migrate = (types == 'gp2') & (sizes > 100) & (gp3_savings > 5)
+            
+            for i in np.flatnonzero(unattached | migrate):
+                volume = volumes[i]
+                size_gb = int(sizes[i])
+                volume_type = str(types[i])
+                monthly_cost = float(monthly_costs[i])
                 
-                # Check for unattached volumes
-                if state == 'available':
+                if unattached[i]:
                     results['unattached_volumes'].append({
                         'volume_id': volume['VolumeId'],
                         'size_gb': size_gb,
@@ -67,28 +92,39 @@ class StorageAnalyzer(AWSService):
                         'confidence': 0.95
                     })
                 
-                # Check for oversized gp2 volumes (should be gp3)
-                if volume_type == 'gp2' and size_gb > 100:
-                    gp3_cost = self._calculate_ebs_cost(size_gb, 'gp3')
-                    savings = monthly_cost - gp3_cost
-                    
-                    if savings > 5:  # Only recommend if saving > $5/month
-                        results['recommendations'].append({
-                            'type': 'migrate_to_gp3',
-                            'resource_id': volume['VolumeId'],
-                            'reason': f'Large gp2 volume ({size_gb}GB) should be gp3',
-                            'monthly_savings': savings,
-                            'risk': 'low',
-                            'action': 'Migrate volume from gp2 to gp3',
-                            'confidence': 0.9
-                        })
+                if migrate[i]:
+                    results['recommendations'].append({
+                        'type': 'migrate_to_gp3',
+                        'resource_id': volume['VolumeId'],
+                        'reason': f'Large gp2 volume ({size_gb}GB) should be gp3',
+                        'monthly_savings': float(gp3_savings[i]),
+                        'risk': 'low',
+                        'action': 'Migrate volume from gp2 to gp3',
+                        'confidence': 0.9
+                    })
             
             return results
             
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to analyze EBS volumes: {str(e)}")
             return results
     
+    def _list_volumes(self) -> Iterator[Dict[str, Any]]:
+        """Yield the EBS volume fields the analysis uses, across all pages"""
+        paginator = self.ec2_client.get_paginator('describe_volumes')
+        pages = paginator.paginate(
+            Filters=[{'Name': 'status', 'Values': ['available', 'in-use']}],
+            PaginationConfig={'PageSize': 500}
+        )
+        for volume in pages.search('Volumes[]'):
+            yield {
+                'VolumeId': volume['VolumeId'],
+                'Size': volume['Size'],
+                'VolumeType': volume['VolumeType'],
+                'State': volume['State'],
+                'CreateTime': volume['CreateTime']
+            }
+    
     def analyze_s3_buckets(self) -> Dict[str, Any]:
         """Analyze S3 buckets for optimization"""
         results = {
@@ -105,101 +141,137 @@ class StorageAnalyzer(AWSService):
             buckets = response['Buckets']
             results['total_buckets'] = len(buckets)
             
-            for bucket in buckets:
-                bucket_name = bucket['Name']
+            # Sizes for every bucket come from batched CloudWatch queries;
+            # the remaining per-bucket lifecycle lookups run concurrently
+            bucket_names = [bucket['Name'] for bucket in buckets]
+            bucket_metrics = self._get_s3_metrics_batch(bucket_names)
+            
+            bucket_results = list(aws_executor.map(
+                self._analyze_bucket,
+                bucket_names,
+                [bucket_metrics[name] for name in bucket_names]
+            ))
+            
+            for metrics, recommendation in filter(None, bucket_results):
+                if recommendation:
+                    results['lifecycle_opportunities'].append(recommendation['resource_id'])
+                    results['recommendations'].append(recommendation)
                 
-                try:
-                    # Get bucket location
-                    location = self.s3_client.get_bucket_location(Bucket=bucket_name)
-                    
-                    # Get bucket metrics
-                    metrics = self._get_s3_metrics(bucket_name)
-                    
-                    if metrics['size_gb'] > 100:  # Only analyze larger buckets
-                        # Check for lifecycle policies
-                        try:
-                            lifecycle = self.s3_client.get_bucket_lifecycle_configuration(
-                                Bucket=bucket_name
-                            )
-                            has_lifecycle = len(lifecycle.get('Rules', [])) > 0
-                        except:
-                            has_lifecycle = False
-                        
-                        if not has_lifecycle and metrics['size_gb'] > 500:
-                            results['lifecycle_opportunities'].append(bucket_name)
-                            results['recommendations'].append({
-                                'type': 's3_lifecycle',
-                                'resource_id': bucket_name,
-                                'reason': f'Large bucket ({metrics["size_gb"]:.0f}GB) without lifecycle policy',
-                                'monthly_savings': metrics['monthly_cost'] * 0.3,  # Assume 30% savings
-                                'risk': 'low',
-                                'action': 'Add lifecycle policy to move old data to Glacier',
-                                'confidence': 0.8
-                            })
-                    
-                    results['total_size_gb'] += metrics['size_gb']
-                    results['total_monthly_cost'] += metrics['monthly_cost']
-                    
-                except Exception as e:
-                    logger.warning(f"Could not analyze bucket {bucket_name}: {str(e)}")
+                results['total_size_gb'] += metrics['size_gb']
+                results['total_monthly_cost'] += metrics['monthly_cost']
             
             return results
             
-        except Exception as e:
+        except AWS_ERRORS as e:
             logger.error(f"Failed to analyze S3 buckets: {str(e)}")
             return results
     
-    def _calculate_ebs_cost(self, size_gb: int, volume_type: str) -> float:
-        """Calculate monthly cost for EBS volume"""
-        # Simplified pricing (actual prices vary by region)
-        pricing = {
-            'gp3': 0.08,  # per GB-month
-            'gp2': 0.10,
-            'io1': 0.125,
-            'io2': 0.125,
-            'st1': 0.045,
-            'sc1': 0.025,
-            'standard': 0.05
-        }
-        
-        base_cost = size_gb * pricing.get(volume_type, 0.10)
+    def _analyze_bucket(
+        self,
+        bucket_name: str,
+        metrics: Dict[str, float]
+    ) -> Optional[Tuple[Dict[str, float], Optional[Dict[str, Any]]]]:
+        """Size metrics and an optional lifecycle recommendation for one bucket"""
+        try:
+            recommendation = None
+            
+            if metrics['size_gb'] > 100:  # Only analyze larger buckets
+                # Check for lifecycle policies
+                try:
+                    lifecycle = self.s3_client.get_bucket_lifecycle_configuration(
+                        Bucket=bucket_name
+                    )
+                    has_lifecycle = len(lifecycle.get('Rules', [])) > 0
+                except ClientError as e:
+                    # The normal "no policy" answer; anything else is a real failure
+                    if e.response['Error']['Code'] != 'NoSuchLifecycleConfiguration':
+                        raise
+                    has_lifecycle = False
+                
+                if not has_lifecycle and metrics['size_gb'] > 500:
+                    recommendation = {
+                        'type': 's3_lifecycle',
+                        'resource_id': bucket_name,
+                        'reason': f'Large bucket ({metrics["size_gb"]:.0f}GB) without lifecycle policy',
+                        'monthly_savings': metrics['monthly_cost'] * 0.3,  # Assume 30% savings
+                        'risk': 'low',
+                        'action': 'Add lifecycle policy to move old data to Glacier',
+                        'confidence': 0.8
+                    }
+            
+            return metrics, recommendation
+            
+        except AWS_ERRORS as e:
+            logger.warning(f"Could not analyze bucket {bucket_name}: {str(e)}")
+            return None
+    
+    def _calculate_ebs_costs(self, sizes: np.ndarray, volume_types: np.ndarray) -> np.ndarray:
+        """Calculate monthly cost for EBS volumes from parallel size/type arrays"""
+        prices = lookup_prices(volume_types, _EBS_GB_MONTH_PRICING, 0.10)
         
         # Add IOPS costs for io1/io2
-        if volume_type in ['io1', 'io2']:
-            base_cost += 100 * 0.065  # Assume 100 IOPS at $0.065 per IOPS
+        iops_costs = np.where(np.isin(volume_types, ['io1', 'io2']), 100 * 0.065, 0.0)
         
-        return base_cost
+        return sizes * prices + iops_costs
     
-    def _get_s3_metrics(self, bucket_name: str) -> Dict[str, float]:
-        """Get S3 bucket size and cost metrics"""
-        try:
-            # Get bucket size from CloudWatch
-            response = self.cw_client.get_metric_statistics(
-                Namespace='AWS/S3',
-                MetricName='BucketSizeBytes',
-                Dimensions=[
-                    {'Name': 'BucketName', 'Value': bucket_name},
-                    {'Name': 'StorageType', 'Value': 'StandardStorage'}
-                ],
-                StartTime=datetime.utcnow() - timedelta(days=2),
-                EndTime=datetime.utcnow(),
-                Period=86400,  # Daily
-                Statistics=['Average']
-            )
-            
-            size_bytes = 0
-            if response['Datapoints']:
-                size_bytes = response['Datapoints'][-1]['Average']
-            
-            size_gb = size_bytes / (1024 ** 3)
-            
-            # Simple cost calculation ($0.023 per GB for first 50TB)
-            monthly_cost = size_gb * 0.023
-            
-            return {
-                'size_gb': size_gb,
-                'monthly_cost': monthly_cost
-            }
+    def _get_s3_metrics_batch(self, bucket_names: List[str]) -> Dict[str, Dict[str, float]]:
+        """
+        Get size and cost metrics for many S3 buckets.
+        
+        One GetMetricData query per bucket, up to BUCKET_METRICS_BATCH_SIZE
+        per request, instead of a get_metric_statistics call per bucket.
+        Buckets without data (or in a failed batch) report zero.
+        """
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(days=2)
+        metrics = {}
+        
+        for offset in range(0, len(bucket_names), BUCKET_METRICS_BATCH_SIZE):
+            batch = bucket_names[offset:offset + BUCKET_METRICS_BATCH_SIZE]
+            queries = [
+                {
+                    'Id': f"b{i}",
+                    'MetricStat': {
+                        'Metric': {
+                            'Namespace': 'AWS/S3',
+                            'MetricName': 'BucketSizeBytes',
+                            'Dimensions': [
+                                {'Name': 'BucketName', 'Value': bucket_name},
+                                {'Name': 'StorageType', 'Value': 'StandardStorage'}
+                            ]
+                        },
+                        'Period': 86400,  # Daily
+                        'Stat': 'Average'
+                    },
+                    'ReturnData': True
+                }
+                for i, bucket_name in enumerate(batch)
+            ]
+            
+            latest = {}
+            try:
+                paginator = self.cw_client.get_paginator('get_metric_data')
+                for page in paginator.paginate(
+                    MetricDataQueries=queries,
+                    StartTime=start_time,
+                    EndTime=end_time,
+                    ScanBy='TimestampDescending'
+                ):
+                    for result in page['MetricDataResults']:
+                        # Newest datapoint first
+                        if result['Values'] and result['Id'] not in latest:
+                            latest[result['Id']] = result['Values'][0]
+                
+            except AWS_ERRORS as e:
+                logger.warning(f"Could not get S3 metrics for {len(batch)} buckets: {str(e)}")
             
-        except Exception:
-            return {'size_gb': 0, 'monthly_cost': 0}
+            for i, bucket_name in enumerate(batch):
+                size_gb = latest.get(f"b{i}", 0) / (1024 ** 3)
+                
+                metrics[bucket_name] = {
+                    'size_gb': size_gb,
+                    # Simple cost calculation ($0.023 per GB for first 50TB)
+                    'monthly_cost': size_gb * 0.023
+                }
+        
+        return metrics
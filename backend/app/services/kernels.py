@@ -0,0 +1,90 @@
+"""
+Numeric kernels shared by the AWS analyzers
+
+Plain NumPy functions over whole arrays, so the analyzers only drop back
+to Python to build result dicts for the rows these select.
+"""
+from typing import Mapping, Tuple
+
+import numpy as np
+
+
+def trailing_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Mean of each `window`-long run that precedes a value.
+
+    Element k is the mean of values[k:k + window], i.e. the baseline for
+    values[k + window]. Built from one cumulative sum, so O(N) for any
+    window. Rounded so all-zero windows stay exactly zero.
+    """
+    running = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    return np.round((running[window:-1] - running[:-window - 1]) / window, 10)
+
+
+def spike_indices(
+    values: np.ndarray,
+    window: int,
+    threshold_percent: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find values more than `threshold_percent` above their trailing mean.
+
+    Returns (indices into `values`, trailing means, percent changes), with
+    the last two aligned to values[window:]. Zero baselines never match.
+    """
+    expected = trailing_mean(values, window)
+    current = values[window:]
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent_change = np.where(expected > 0, (current - expected) / expected * 100, np.nan)
+    
+    return np.flatnonzero(percent_change > threshold_percent) + window, expected, percent_change
+
+
+def lookup_prices(keys: np.ndarray, prices: Mapping[str, float], default: float) -> np.ndarray:
+    """
+    Map an array of string keys to prices.
+
+    Keys are encoded to small integer codes first, so the price table is
+    consulted once per distinct key rather than once per element.
+    """
+    unique_keys, codes = np.unique(keys, return_inverse=True)
+    unique_prices = np.array([prices.get(key, default) for key in unique_keys], dtype=np.float64)
+    return unique_prices[codes]
+
+
+def top_k_sums(keys: np.ndarray, values: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum `values` per distinct key and return the `k` largest totals.
+
+    Grouping is one encode + bincount over the columns; top-k selection
+    is an argpartition, so only the selected totals are sorted.
+    """
+    unique_keys, codes = np.unique(keys, return_inverse=True)
+    totals = np.bincount(codes, weights=values, minlength=len(unique_keys))
+    
+    if k < len(totals):
+        selected = np.argpartition(-totals, k)[:k]
+    else:
+        selected = np.arange(len(totals))
+    order = selected[np.argsort(-totals[selected], kind='stable')]
+    return unique_keys[order], totals[order]
+
+
+def interval_breaches(
+    actual: np.ndarray,
+    predicted: np.ndarray,
+    lower: np.ndarray,
+    upper: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compare actual values against a prediction interval.
+
+    Returns (direction, deviation percent): direction is 1 above the
+    interval, -1 below it and 0 inside; deviation is |actual - predicted|
+    as a percent of predicted (inf when predicted is 0).
+    """
+    direction = np.where(actual > upper, 1, np.where(actual < lower, -1, 0)).astype(np.int8)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation = np.abs((actual - predicted) / predicted * 100)
+    return direction, deviation
@@ -1,16 +1,68 @@
 """
 Cost prediction and anomaly detection using Prophet
 """
+import io
+import threading
 import pandas as pd
 import numpy as np
 from prophet import Prophet
+from prophet.serialize import model_from_json, model_to_json
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 import logging
 from sklearn.preprocessing import StandardScaler
 
+from app.services.kernels import interval_breaches
+
 logger = logging.getLogger(__name__)
 
+# Deviation percents above which an anomaly becomes medium, high, critical
+SEVERITY_THRESHOLDS = np.array([20, 30, 50])
+SEVERITY_LABELS = np.array(['low', 'medium', 'high', 'critical'])
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Forecast columns CostPredictor reads after predict()
+FORECAST_COLUMNS = ['ds', 'yhat', 'yhat_lower', 'yhat_upper', 'trend']
+
+# Simulations behind yhat_lower/yhat_upper. Prophet's default of 1000
+# dominates predict() time; a few hundred still resolve the 95% interval
+UNCERTAINTY_SAMPLES = 200
+
+
+# Stan backends loaded so far, one per thread
+_stan_backends = threading.local()
+
+
+class _Prophet(Prophet):
+    """
+    Prophet that reuses its thread's loaded Stan backend.
+    
+    Loading a backend builds a CmdStanModel, which probes the bundled
+    binary; fits in the same worker thread can share one. Backends keep
+    the last fit as state, so they are never shared between threads.
+    """
+    
+    def _load_stan_backend(self, stan_backend):
+        backend = getattr(_stan_backends, 'backend', None)
+        if backend is None or stan_backend is not None:
+            super()._load_stan_backend(stan_backend)
+            if stan_backend is None:
+                _stan_backends.backend = self.stan_backend
+        else:
+            self.stan_backend = backend
+
+
+def _changepoints_for(points: int) -> int:
+    """
+    Changepoint count scaled to the series length.
+    
+    Fit time grows with the changepoint count, and short series (the
+    anomaly check trains on under 30 points) cannot support Prophet's
+    default of 25 anyway.
+    """
+    return min(25, max(2, points // 3))
+
 
 class CostPredictor:
     """ML-based cost prediction and anomaly detection"""
@@ -20,12 +72,13 @@ class CostPredictor:
         self.scaler = StandardScaler()
         self.forecast = None
         
-    def train(self, historical_costs: List[Dict[str, Any]]) -> bool:
+    def train(self, historical_costs: Union[List[Dict[str, Any]], Dict[str, np.ndarray]]) -> bool:
         """
         Train Prophet model on historical cost data
         
         Args:
-            historical_costs: List of dicts with 'date' and 'cost' keys
+            historical_costs: List of dicts, or dict of column arrays, with
+                'date' and 'cost' keys
         
         Returns:
             bool: True if training successful
@@ -37,12 +90,15 @@ class CostPredictor:
             df['y'] = df['cost'].astype(float)
             
             # Initialize Prophet with custom parameters
-            self.model = Prophet(
+            self.model = _Prophet(
                 daily_seasonality=False,
                 weekly_seasonality=True,
                 yearly_seasonality=False,
                 changepoint_prior_scale=0.05,  # More resistant to outliers
-                interval_width=0.95  # 95% confidence interval
+                n_changepoints=_changepoints_for(len(df)),
+                interval_width=0.95,  # 95% confidence interval
+                mcmc_samples=0,  # MAP fit only
+                uncertainty_samples=UNCERTAINTY_SAMPLES
             )
             
             # Add US holidays (affects cloud usage)
@@ -58,6 +114,26 @@ class CostPredictor:
             logger.error(f"Failed to train cost predictor: {str(e)}")
             return False
     
+    def to_json(self) -> Dict[str, str]:
+        """
+        Serialize the fitted model and its forecast for caching
+        
+        Uses Prophet's own JSON serializer (fitted parameters only), so no
+        Stan objects are pickled.
+        """
+        return {
+            'model': model_to_json(self.model),
+            'forecast': self.forecast.to_json(orient='split', date_format='iso')
+        }
+    
+    @classmethod
+    def from_json(cls, payload: Dict[str, str]) -> 'CostPredictor':
+        """Rebuild a fitted predictor from `to_json` output without refitting"""
+        predictor = cls()
+        predictor.model = model_from_json(payload['model'])
+        predictor.forecast = pd.read_json(io.StringIO(payload['forecast']), orient='split', convert_dates=['ds'])
+        return predictor
+    
     def predict_next_days(self, days: int = 30) -> List[Dict[str, Any]]:
         """
         Predict costs for the next N days
@@ -76,23 +152,29 @@ class CostPredictor:
             # Create future dataframe
             future = self.model.make_future_dataframe(periods=days)
             
-            # Generate forecast
-            self.forecast = self.model.predict(future)
+            # Generate forecast, keeping only the columns read later (Prophet
+            # returns ~15 component columns); the anomaly-model cache stores it
+            self.forecast = self.model.predict(future)[FORECAST_COLUMNS]
             
-            # Extract predictions for future dates only
-            predictions = []
+            # Extract predictions for future dates only, column-wise
             future_forecast = self.forecast.tail(days)
             
-            for _, row in future_forecast.iterrows():
-                predictions.append({
-                    'date': row['ds'].strftime('%Y-%m-%d'),
-                    'predicted_cost': float(row['yhat']),
-                    'lower_bound': float(row['yhat_lower']),
-                    'upper_bound': float(row['yhat_upper']),
-                    'trend': float(row['trend']),
-                })
-            
-            return predictions
+            return [
+                {
+                    'date': date,
+                    'predicted_cost': predicted,
+                    'lower_bound': lower,
+                    'upper_bound': upper,
+                    'trend': trend,
+                }
+                for date, predicted, lower, upper, trend in zip(
+                    future_forecast['ds'].dt.strftime('%Y-%m-%d').tolist(),
+                    future_forecast['yhat'].astype(float).tolist(),
+                    future_forecast['yhat_lower'].astype(float).tolist(),
+                    future_forecast['yhat_upper'].astype(float).tolist(),
+                    future_forecast['trend'].astype(float).tolist()
+                )
+            ]
             
         except Exception as e:
             logger.error(f"Failed to generate predictions: {str(e)}")
@@ -110,40 +192,45 @@ class CostPredictor:
         Returns:
             List of detected anomalies
         """
-        if not self.model or not self.forecast:
+        if not self.model or self.forecast is None:
             logger.warning("Model not trained or no forecast available")
             return []
         
-        anomalies = []
+        if not recent_costs:
+            return []
         
         try:
-            for cost_data in recent_costs:
-                date = pd.to_datetime(cost_data['date'])
-                actual_cost = float(cost_data['cost'])
-                
-                # Find prediction for this date
-                forecast_row = self.forecast[self.forecast['ds'] == date]
-                
-                if not forecast_row.empty:
-                    predicted = float(forecast_row['yhat'].iloc[0])
-                    lower = float(forecast_row['yhat_lower'].iloc[0])
-                    upper = float(forecast_row['yhat_upper'].iloc[0])
-                    
-                    # Check if outside confidence interval
-                    if actual_cost < lower or actual_cost > upper:
-                        deviation_percent = abs((actual_cost - predicted) / predicted * 100)
-                        
-                        anomalies.append({
-                            'date': date.strftime('%Y-%m-%d'),
-                            'actual_cost': actual_cost,
-                            'expected_cost': predicted,
-                            'lower_bound': lower,
-                            'upper_bound': upper,
-                            'deviation_percent': deviation_percent,
-                            'type': 'spike' if actual_cost > upper else 'drop',
-                            'severity': self._calculate_severity(deviation_percent),
-                            'confidence': 0.95,  # Based on our interval width
-                        })
+            # Match dates as int64 nanoseconds by binary search over the
+            # (ascending) forecast dates; no per-call index or DataFrame
+            dates = pd.to_datetime([cost_data['date'] for cost_data in recent_costs])
+            wanted = dates.asi8
+            forecast_ns = self.forecast['ds'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+            positions = np.searchsorted(forecast_ns, wanted).clip(max=max(len(forecast_ns) - 1, 0))
+            matched = forecast_ns[positions] == wanted if len(forecast_ns) else np.zeros(len(wanted), dtype=bool)
+            rows = positions[matched]
+            
+            # Classify every row at once; dicts are built only for the breaches
+            actual = np.array([cost_data['cost'] for cost_data in recent_costs], dtype=np.float64)[matched]
+            predicted = self.forecast['yhat'].to_numpy(dtype=np.float64)[rows]
+            lower = self.forecast['yhat_lower'].to_numpy(dtype=np.float64)[rows]
+            upper = self.forecast['yhat_upper'].to_numpy(dtype=np.float64)[rows]
+            direction, deviation = interval_breaches(actual, predicted, lower, upper)
+            severity = self._calculate_severity(deviation)
+            dates = dates[matched].strftime('%Y-%m-%d')
+            
+            anomalies = []
+            for i in np.flatnonzero(direction):
+                anomalies.append({
+                    'date': dates[i],
+                    'actual_cost': float(actual[i]),
+                    'expected_cost': float(predicted[i]),
+                    'lower_bound': float(lower[i]),
+                    'upper_bound': float(upper[i]),
+                    'deviation_percent': float(deviation[i]),
+                    'type': 'spike' if direction[i] > 0 else 'drop',
+                    'severity': str(severity[i]),
+                    'confidence': 0.95,  # Based on our interval width
+                })
             
             return anomalies
             
@@ -151,16 +238,10 @@ class CostPredictor:
             logger.error(f"Failed to detect anomalies: {str(e)}")
             return []
     
-    def _calculate_severity(self, deviation_percent: float) -> str:
-        """Calculate anomaly severity based on deviation"""
-        if deviation_percent > 50:
-            return 'critical'
-        elif deviation_percent > 30:
-            return 'high'
-        elif deviation_percent > 20:
-            return 'medium'
-        else:
-            return 'low'
+    def _calculate_severity(self, deviation_percent: np.ndarray) -> np.ndarray:
+        """Calculate anomaly severity based on deviation (above 20/30/50%)"""
+        levels = np.searchsorted(SEVERITY_THRESHOLDS, deviation_percent, side='left')
+        return SEVERITY_LABELS[levels]
     
     def get_cost_insights(self) -> Dict[str, Any]:
         """
@@ -169,38 +250,47 @@ class CostPredictor:
         Returns:
             Dictionary containing various insights
         """
-        if not self.model or not self.forecast:
+        if not self.model or self.forecast is None:
             return {}
         
         try:
             # Calculate trend
-            recent_trend = self.forecast.tail(30)['trend'].mean()
-            month_ago_trend = self.forecast.tail(60).head(30)['trend'].mean()
+            trend = self.forecast['trend']
+            recent_trend = trend.iloc[-30:].mean()
+            month_ago_trend = trend.iloc[-60:].iloc[:30].mean()
             trend_change = ((recent_trend - month_ago_trend) / month_ago_trend * 100) if month_ago_trend > 0 else 0
             
             # Weekly patterns
-            forecast_with_day = self.forecast.copy()
-            forecast_with_day['day_of_week'] = pd.to_datetime(forecast_with_day['ds']).dt.dayofweek
-            weekly_pattern = forecast_with_day.groupby('day_of_week')['yhat'].mean().to_dict()
+            weekly_pattern = self._weekly_means()
             
             # Find cheapest and most expensive days
-            cheapest_day = min(weekly_pattern, key=weekly_pattern.get)
-            expensive_day = max(weekly_pattern, key=weekly_pattern.get)
-            
-            days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+            cheapest_day = int(np.nanargmin(weekly_pattern))
+            expensive_day = int(np.nanargmax(weekly_pattern))
             
             return {
                 'trend_direction': 'increasing' if trend_change > 0 else 'decreasing',
-                'trend_change_percent': abs(trend_change),
-                'cheapest_day': days[cheapest_day],
-                'expensive_day': days[expensive_day],
-                'weekly_savings_potential': weekly_pattern[expensive_day] - weekly_pattern[cheapest_day],
+                'trend_change_percent': float(abs(trend_change)),
+                'cheapest_day': WEEKDAYS[cheapest_day],
+                'expensive_day': WEEKDAYS[expensive_day],
+                'weekly_savings_potential': float(weekly_pattern[expensive_day] - weekly_pattern[cheapest_day]),
                 'forecast_confidence': 0.95,
             }
             
         except Exception as e:
             logger.error(f"Failed to generate insights: {str(e)}")
             return {}
+    
+    def _weekly_means(self) -> np.ndarray:
+        """
+        Mean forecast cost per weekday, Monday first (NaN for absent days)
+        
+        Not memoized: predict_next_days replaces self.forecast.
+        """
+        day_of_week = self.forecast['ds'].dt.dayofweek.to_numpy()  # ds is already datetime
+        counts = np.bincount(day_of_week, minlength=7)
+        sums = np.bincount(day_of_week, weights=self.forecast['yhat'].to_numpy(dtype=np.float64), minlength=7)
+        with np.errstate(invalid='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
 
 
 class ResourceUtilizationPredictor:
@@ -210,13 +300,14 @@ class ResourceUtilizationPredictor:
         self.models = {}  # One model per resource type
         
     def train_resource_model(self, resource_type: str, 
-                            utilization_data: List[Dict[str, Any]]) -> bool:
+                            utilization_data: Union[List[Dict[str, Any]], Dict[str, np.ndarray]]) -> bool:
         """
         Train a model for specific resource type utilization
         
         Args:
             resource_type: Type of resource (ec2, rds, etc.)
-            utilization_data: Historical utilization data
+            utilization_data: Historical utilization data, either records or
+                column arrays, with 'timestamp' and 'utilization' keys
         """
         try:
             df = pd.DataFrame(utilization_data)
@@ -224,10 +315,13 @@ class ResourceUtilizationPredictor:
             df['y'] = df['utilization'].astype(float)
             
             # Create model with hourly seasonality for resources
-            model = Prophet(
+            model = _Prophet(
                 daily_seasonality=True,
                 weekly_seasonality=True,
-                changepoint_prior_scale=0.1
+                changepoint_prior_scale=0.1,
+                n_changepoints=_changepoints_for(len(df)),
+                mcmc_samples=0,
+                uncertainty_samples=0  # Only yhat is used; skips interval simulation in predict()
             )
             
             model.fit(df[['ds', 'y']])
@@ -261,20 +355,23 @@ class ResourceUtilizationPredictor:
             future = model.make_future_dataframe(periods=168, freq='H')
             forecast = model.predict(future)
             
-            # Find underutilized periods
-            underutilized = []
+            # Find underutilized periods; only rows under the threshold are materialized
             future_forecast = forecast.tail(168)
+            predicted = future_forecast['yhat'].to_numpy(dtype=np.float64)
+            below = predicted < threshold
             
-            for _, row in future_forecast.iterrows():
-                if row['yhat'] < threshold:
-                    underutilized.append({
-                        'timestamp': row['ds'].isoformat(),
-                        'predicted_utilization': float(row['yhat']),
-                        'confidence': float(1 - (row['yhat_upper'] - row['yhat_lower']) / 100),
-                        'recommendation': 'Consider scheduling shutdown' if row['yhat'] < 10 else 'Consider downsizing'
-                    })
-            
-            return underutilized
+            return [
+                {
+                    'timestamp': timestamp.isoformat(),
+                    'predicted_utilization': utilization,
+                    'recommendation': recommendation
+                }
+                for timestamp, utilization, recommendation in zip(
+                    future_forecast['ds'][below].tolist(),
+                    predicted[below].tolist(),
+                    np.where(predicted[below] < 10, 'Consider scheduling shutdown', 'Consider downsizing').tolist()
+                )
+            ]
             
         except Exception as e:
             logger.error(f"Failed to predict underutilization: {str(e)}")
@@ -2,13 +2,24 @@
 Background tasks for automated analysis
 """
 from celery import shared_task
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, select, update
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
+from typing import Any, Dict, List
 import logging
+import os
+import numpy as np
 
-from app.database import SessionLocal
-from app.models.base import CloudAccount, Organization
+from app.database import SessionLocal, bulk_insert
+from app.cache import (
+    invalidate_org_cache, get_json_sync, set_json_sync, COST_PREDICTION_KEY, COST_PREDICTION_TTL,
+    ANOMALY_MODEL_KEY, ANOMALY_MODEL_TTL
+)
+from app.models.base import CloudAccount, Organization, User
 from app.models.aws_resources import CostSnapshot, Recommendation
+from app.services.aws_base import AWSService
 from app.services.aws_cost_explorer import AWSCostExplorer
 from app.services.aws_ec2_analyzer import EC2Analyzer
 from app.services.aws_storage_analyzer import StorageAnalyzer
@@ -16,6 +27,9 @@ from app.services.ml.cost_predictor import CostPredictor
 
 logger = logging.getLogger(__name__)
 
+# Snapshots per account that anomaly checks train on
+ANOMALY_HISTORY_POINTS = 30
+
 
 @shared_task
 def run_daily_analysis():
@@ -58,8 +72,11 @@ def analyze_account(account_id: str):
         
         logger.info(f"Analyzing account {account.account_name}")
         
+        # One credential decryption / boto3 Session shared by both analyzers
+        service = AWSService(account.credentials_encrypted)
+        
         # Cost Analysis
-        cost_explorer = AWSCostExplorer(account.credentials_encrypted)
+        cost_explorer = AWSCostExplorer.from_session(service.session)
         current_spend = cost_explorer.get_current_month_spend()
         service_costs = cost_explorer.get_service_costs(30)
         
@@ -74,36 +91,32 @@ def analyze_account(account_id: str):
         db.add(snapshot)
         
         # EC2 Analysis
-        ec2_analyzer = EC2Analyzer(account.credentials_encrypted)
+        ec2_analyzer = EC2Analyzer.from_session(service.session)
         opportunities = ec2_analyzer.find_optimization_opportunities()
         
-        # Store recommendations
-        for opp in opportunities:
-            existing = db.query(Recommendation).filter(
+        # Store recommendations not already active for this organization;
+        # one query for the existing keys instead of one per opportunity
+        existing = set(db.execute(
+            select(Recommendation.recommendation_type, Recommendation.description).where(
                 Recommendation.organization_id == account.organization_id,
-                Recommendation.recommendation_type == opp['type'],
-                Recommendation.description == opp['reason'],
                 Recommendation.status == 'active'
-            ).first()
-            
-            if not existing:
-                rec = Recommendation(
-                    organization_id=account.organization_id,
-                    recommendation_type=opp['type'],
-                    title=opp['type'].replace('_', ' ').title(),
-                    description=opp['reason'],
-                    monthly_savings=opp.get('monthly_savings', 0),
-                    risk_level=opp.get('risk', 'medium'),
-                    confidence_score=opp.get('confidence', 0.5),
-                    action_steps=[opp['action']]
-                )
-                db.add(rec)
+            )
+        ).tuples())
+        
+        recommendations = []
+        for opp in opportunities:
+            key = (opp['type'], opp['reason'])
+            if key not in existing:
+                existing.add(key)
+                recommendations.append(_recommendation_row(account.organization_id, opp))
+        bulk_insert(db, Recommendation, recommendations)
         
         # Update last sync
         account.last_sync = datetime.utcnow()
         account.last_sync_status = 'success'
         
         db.commit()
+        invalidate_org_cache(account.organization_id)
         
         logger.info(f"Successfully analyzed account {account.account_name}")
         return f"Analysis complete for {account.account_name}"
@@ -122,68 +135,364 @@ def analyze_account(account_id: str):
         db.close()
 
 
+def _recommendation_row(org_id, item: Dict[str, Any]) -> Dict[str, Any]:
+    """Map an analyzer finding to a Recommendation insert row"""
+    return {
+        'organization_id': org_id,
+        'recommendation_type': item['type'],
+        'title': item['type'].replace('_', ' ').title(),
+        'description': item['reason'],
+        'monthly_savings': item.get('monthly_savings', 0),
+        'risk_level': item.get('risk', 'medium'),
+        'confidence_score': item.get('confidence', 0.5),
+        'action_steps': [item['action']]
+    }
+
+
+def _analyze_cost(service: AWSService, account_id: str) -> Dict[str, Any]:
+    cost_explorer = AWSCostExplorer.from_session(service.session, account_id)
+    return {
+        'current_month': cost_explorer.get_current_month_spend(),
+        'daily_costs': cost_explorer.get_daily_costs(30),
+        'service_breakdown': cost_explorer.get_service_costs(30),
+        'anomalies': cost_explorer.detect_cost_anomalies()
+    }
+
+
+def _analyze_ec2(service: AWSService, account_id: str) -> Dict[str, Any]:
+    ec2_analyzer = EC2Analyzer.from_session(service.session, account_id)
+    return ec2_analyzer.analyze_instances()
+
+
+def _analyze_storage(service: AWSService, account_id: str) -> Dict[str, Any]:
+    storage_analyzer = StorageAnalyzer.from_session(service.session, account_id)
+    ebs_results = storage_analyzer.analyze_ebs_volumes()
+    s3_results = storage_analyzer.analyze_s3_buckets()
+    
+    return {
+        'ebs': ebs_results,
+        's3': s3_results,
+        'total_monthly_cost': ebs_results['total_monthly_cost'] + s3_results['total_monthly_cost'],
+        'total_recommendations': len(ebs_results['recommendations']) + len(s3_results['recommendations'])
+    }
+
+
+# Analysis type -> analyzer run by run_account_analysis, called with the
+# shared AWSService and the account's stored AWS account id
+ANALYZERS = {
+    'cost': _analyze_cost,
+    'ec2': _analyze_ec2,
+    'storage': _analyze_storage,
+}
+
+
+@shared_task
+def run_account_analysis(account_id: str, analysis_types: List[str]):
+    """Run an on-demand analysis requested through the API"""
+    db = SessionLocal()
+    account = None
+    
+    try:
+        # Load the account once and reuse it for every row written below
+        account = db.get(CloudAccount, account_id)
+        if not account:
+            return {'status': 'failed', 'error': f"Account {account_id} not found"}
+        
+        org_id = account.organization_id
+        
+        # Decrypt the credentials and build the boto3 Session once; every
+        # analyzer below shares it
+        service = AWSService(account.credentials_encrypted)
+        
+        # The analyzers are independent boto3 call chains, so run them
+        # concurrently; all DB writes stay on this thread (sessions are
+        # not thread-safe)
+        selected = [name for name in analysis_types if name in ANALYZERS]
+        with ThreadPoolExecutor(max_workers=max(len(selected), 1)) as executor:
+            futures = {
+                name: executor.submit(ANALYZERS[name], service, account.account_id)
+                for name in selected
+            }
+        results = {name: future.result() for name, future in futures.items()}
+        recommendations = []
+        
+        # Store cost snapshot
+        if 'cost' in results and results['cost']['current_month'].get('total'):
+            snapshot = CostSnapshot(
+                cloud_account_id=account.id,
+                organization_id=org_id,
+                snapshot_date=datetime.utcnow(),
+                total_cost=results['cost']['current_month']['total'],
+                service_costs=results['cost']['service_breakdown']
+            )
+            db.add(snapshot)
+        
+        # Queue EC2 recommendations for the batched insert below
+        if 'ec2' in results:
+            recommendations.extend(
+                _recommendation_row(org_id, opp) for opp in results['ec2']['opportunities']
+            )
+        
+        # Queue storage recommendations
+        if 'storage' in results:
+            storage = results['storage']
+            recommendations.extend(
+                _recommendation_row(org_id, rec_data)
+                for rec_data in storage['ebs']['recommendations'] + storage['s3']['recommendations']
+            )
+        
+        # Store all recommendations in one batched INSERT
+        bulk_insert(db, Recommendation, recommendations)
+        
+        # Update last sync status
+        account.last_sync = datetime.utcnow()
+        account.last_sync_status = "success"
+        
+        db.commit()
+        invalidate_org_cache(org_id)
+        logger.info(f"Analysis completed for account {account_id}")
+        
+        # A new snapshot changes the training data; refresh the cached
+        # prediction now rather than on the next nightly run
+        if 'cost' in results and results['cost']['current_month'].get('total'):
+            train_cost_prediction.delay(account_id)
+        
+        return {
+            'status': 'success',
+            'analysis_types': analysis_types,
+            'recommendations': len(recommendations),
+            'potential_monthly_savings': sum(r['monthly_savings'] for r in recommendations)
+        }
+        
+    except Exception as e:
+        logger.error(f"Analysis failed for account {account_id}: {str(e)}")
+        
+        # Update sync status (discard any half-written rows first)
+        db.rollback()
+        if account:
+            account.last_sync = datetime.utcnow()
+            account.last_sync_status = f"failed: {str(e)}"
+            db.commit()
+        
+        return {'status': 'failed', 'error': str(e)}
+    
+    finally:
+        db.close()
+
+
+@shared_task
+def refresh_cost_predictions():
+    """Schedule cost prediction training for all active cloud accounts"""
+    db = SessionLocal()
+    
+    try:
+        account_ids = [row.id for row in db.query(CloudAccount.id).filter(
+            CloudAccount.is_active == True
+        )]
+        
+        for account_id in account_ids:
+            train_cost_prediction.delay(str(account_id))
+        
+        return f"Scheduled cost prediction training for {len(account_ids)} accounts"
+        
+    finally:
+        db.close()
+
+
+def _cost_records(dates: np.ndarray, costs: np.ndarray) -> List[Dict[str, Any]]:
+    """Convert date/cost arrays back to the records the API returns"""
+    return [
+        {'date': str(day), 'cost': float(cost)}
+        for day, cost in zip(dates, costs)
+    ]
+
+
+@shared_task
+def train_cost_prediction(cloud_account_id: str, force: bool = False):
+    """
+    Train the cost predictor for one account and cache its output.
+    
+    Training is skipped when the cached prediction was built from the same
+    snapshots (same latest snapshot_date), unless force=True.
+    """
+    db = SessionLocal()
+    cache_key = COST_PREDICTION_KEY.format(account_id=cloud_account_id)
+    
+    try:
+        latest_date = db.scalar(
+            select(func.max(CostSnapshot.snapshot_date)).where(
+                CostSnapshot.cloud_account_id == cloud_account_id
+            )
+        )
+        data_version = latest_date.isoformat() if latest_date else None
+        
+        if not force and data_version:
+            cached = get_json_sync(cache_key)
+            if cached and cached.get('data_version') == data_version:
+                return {'status': 'unchanged', 'data_version': data_version}
+        
+        # Latest 90 snapshots, returned oldest-first by the database;
+        # only the two columns training needs are fetched
+        latest = select(CostSnapshot.snapshot_date, CostSnapshot.total_cost).where(
+            CostSnapshot.cloud_account_id == cloud_account_id
+        ).order_by(CostSnapshot.snapshot_date.desc()).limit(90).subquery()
+        rows = db.execute(select(latest).order_by(latest.c.snapshot_date)).all()
+        
+        if len(rows) < 30:
+            return {'status': 'skipped', 'reason': 'Not enough historical data (need at least 30 days)'}
+        
+        dates = np.array([row.snapshot_date for row in rows], dtype='datetime64[D]')
+        costs = np.fromiter((row.total_cost for row in rows), dtype=np.float64, count=len(rows))
+        
+        predictor = CostPredictor()
+        if not predictor.train({'date': dates, 'cost': costs}):
+            return {'status': 'failed', 'error': 'Failed to train prediction model'}
+        
+        predictions = predictor.predict_next_days(30)
+        
+        set_json_sync(
+            cache_key,
+            {
+                'predictions': predictions,
+                'anomalies': predictor.detect_anomalies(_cost_records(dates[-7:], costs[-7:])),  # Last 7 days
+                'insights': predictor.get_cost_insights(),
+                'historical_data': _cost_records(dates[-30:], costs[-30:]),  # Last 30 days for chart
+                'generated_at': datetime.utcnow().isoformat(),
+                'data_version': data_version
+            },
+            COST_PREDICTION_TTL
+        )
+        
+        logger.info(f"Cached cost prediction for account {cloud_account_id}")
+        return {'status': 'success', 'predictions': len(predictions)}
+        
+    except Exception as e:
+        logger.error(f"Cost prediction training failed for account {cloud_account_id}: {str(e)}")
+        return {'status': 'failed', 'error': str(e)}
+    
+    finally:
+        db.close()
+
+
+def _anomaly_predictor(account_id, costs: List[Dict[str, Any]]):
+    """
+    Predictor fitted on all but the latest cost, forecasting through it.
+    
+    Reused from Redis while the snapshot series is unchanged, so the hourly
+    anomaly check refits Prophet only after new cost data arrives.
+    """
+    cache_key = ANOMALY_MODEL_KEY.format(account_id=account_id, data_version=costs[-1]['date'])
+    
+    cached = get_json_sync(cache_key)
+    if cached:
+        try:
+            return CostPredictor.from_json(cached)
+        except Exception as e:
+            logger.warning(f"Discarding cached anomaly model for account {account_id}: {str(e)}")
+    
+    predictor = CostPredictor()
+    if not predictor.train(costs[:-1]):
+        return None
+    
+    # Forecast far enough ahead to cover the date being checked
+    horizon = (datetime.fromisoformat(costs[-1]['date']) - datetime.fromisoformat(costs[-2]['date'])).days
+    if not predictor.predict_next_days(max(horizon, 1)):
+        return None
+    
+    set_json_sync(cache_key, predictor.to_json(), ANOMALY_MODEL_TTL)
+    return predictor
+
+
+def _detect_account_anomalies(account_id, costs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Check an account's latest cost against a forecast from its earlier costs"""
+    predictor = _anomaly_predictor(account_id, costs)
+    return predictor.detect_anomalies([costs[-1]]) if predictor else []
+
+
 @shared_task
 def check_cost_anomalies():
     """Check for cost anomalies across all accounts"""
     db = SessionLocal()
     
     try:
-        # Get accounts with recent cost data
-        accounts = db.query(CloudAccount).filter(
-            CloudAccount.is_active == True,
-            CloudAccount.last_sync != None
+        # Get accounts with recent cost data (only the columns used below,
+        # as plain rows rather than identity-mapped ORM objects)
+        accounts = db.execute(
+            select(CloudAccount.id, CloudAccount.account_name, CloudAccount.organization_id).where(
+                CloudAccount.is_active == True,
+                CloudAccount.last_sync != None
+            )
+        ).all()
+        
+        # Latest snapshots for every account in one query, oldest-first per account
+        ranked = select(
+            CostSnapshot.cloud_account_id,
+            CostSnapshot.snapshot_date,
+            CostSnapshot.total_cost,
+            func.row_number().over(
+                partition_by=CostSnapshot.cloud_account_id,
+                order_by=CostSnapshot.snapshot_date.desc()
+            ).label('rn')
+        ).where(
+            CostSnapshot.cloud_account_id.in_([account.id for account in accounts])
+        ).subquery()
+        rows = db.execute(
+            select(ranked.c.cloud_account_id, ranked.c.snapshot_date, ranked.c.total_cost)
+            .where(ranked.c.rn <= ANOMALY_HISTORY_POINTS)
+            .order_by(ranked.c.cloud_account_id, ranked.c.snapshot_date)
         ).all()
         
+        history = defaultdict(list)
+        for row in rows:
+            history[row.cloud_account_id].append({
+                'date': row.snapshot_date.strftime('%Y-%m-%d'),
+                'cost': float(row.total_cost)
+            })
+        
+        candidates = [account for account in accounts if len(history[account.id]) >= 7]
+        
+        # Fits are independent and Prophet's Stan optimizer runs out of
+        # process (cmdstan), so threads overlap them across cores. Prefork
+        # Celery workers are daemonic and cannot start a process pool
+        with ThreadPoolExecutor(max_workers=max(min(len(candidates), os.cpu_count() or 1), 1)) as executor:
+            results = list(executor.map(
+                _detect_account_anomalies,
+                [account.id for account in candidates],
+                [history[account.id] for account in candidates]
+            ))
+        
+        # DB writes stay on this thread's session
         anomalies_found = []
+        recommendations = []
         
-        for account in accounts:
-            # Get recent cost snapshots
-            snapshots = db.query(CostSnapshot).filter(
-                CostSnapshot.cloud_account_id == account.id
-            ).order_by(CostSnapshot.snapshot_date.desc()).limit(30).all()
-            
-            if len(snapshots) >= 7:
-                # Prepare data for ML
-                costs = [
-                    {
-                        'date': s.snapshot_date.strftime('%Y-%m-%d'),
-                        'cost': float(s.total_cost)
-                    }
-                    for s in reversed(snapshots)
-                ]
+        for account, anomalies in zip(candidates, results):
+            if anomalies:
+                anomalies_found.append({
+                    'account': account.account_name,
+                    'anomalies': anomalies
+                })
                 
-                # Train and detect anomalies
-                predictor = CostPredictor()
-                if predictor.train(costs[:-1]):
-                    anomalies = predictor.detect_anomalies([costs[-1]])
-                    
-                    if anomalies:
-                        anomalies_found.append({
-                            'account': account.account_name,
-                            'anomalies': anomalies
+                # Create high-priority recommendation
+                for anomaly in anomalies:
+                    if anomaly['severity'] in ['critical', 'high']:
+                        recommendations.append({
+                            'organization_id': account.organization_id,
+                            'recommendation_type': 'cost_anomaly',
+                            'title': "Cost Anomaly Detected",
+                            'description': f"Unusual {anomaly['type']} detected: "
+                                           f"${anomaly['actual_cost']:.2f} vs expected "
+                                           f"${anomaly['expected_cost']:.2f}",
+                            'monthly_savings': 0,  # Not a savings opportunity
+                            'risk_level': 'high',
+                            'confidence_score': anomaly['confidence'],
+                            'action_steps': [
+                                "Investigate recent changes",
+                                "Check for unauthorized resources",
+                                "Review auto-scaling settings"
+                            ]
                         })
-                        
-                        # Create high-priority recommendation
-                        for anomaly in anomalies:
-                            if anomaly['severity'] in ['critical', 'high']:
-                                rec = Recommendation(
-                                    organization_id=account.organization_id,
-                                    recommendation_type='cost_anomaly',
-                                    title=f"Cost Anomaly Detected",
-                                    description=f"Unusual {anomaly['type']} detected: "
-                                               f"${anomaly['actual_cost']:.2f} vs expected "
-                                               f"${anomaly['expected_cost']:.2f}",
-                                    monthly_savings=0,  # Not a savings opportunity
-                                    risk_level='high',
-                                    confidence_score=anomaly['confidence'],
-                                    action_steps=[
-                                        "Investigate recent changes",
-                                        "Check for unauthorized resources",
-                                        "Review auto-scaling settings"
-                                    ]
-                                )
-                                db.add(rec)
         
+        bulk_insert(db, Recommendation, recommendations)
         db.commit()
         
         logger.info(f"Anomaly check complete. Found {len(anomalies_found)} anomalies")
@@ -204,43 +513,68 @@ def generate_optimization_report(organization_id: str = None):
     
     try:
         # Get all organizations or specific one
+        query = db.query(Organization)
         if organization_id:
-            orgs = [db.query(Organization).get(organization_id)]
-        else:
-            orgs = db.query(Organization).all()
+            query = query.filter(Organization.id == organization_id)
+        orgs = query.all()
+        org_ids = [org.id for org in orgs]
+        
+        # Savings total and top 5 active recommendations per organization,
+        # aggregated in one query (served by ix_rec_org_status_savings)
+        ranked_recs = select(
+            Recommendation.organization_id,
+            Recommendation.title,
+            Recommendation.monthly_savings,
+            Recommendation.risk_level,
+            func.sum(Recommendation.monthly_savings).over(
+                partition_by=Recommendation.organization_id
+            ).label('total_savings'),
+            func.row_number().over(
+                partition_by=Recommendation.organization_id,
+                order_by=Recommendation.monthly_savings.desc()
+            ).label('rn')
+        ).where(
+            Recommendation.organization_id.in_(org_ids),
+            Recommendation.status == 'active'
+        ).subquery()
+        
+        total_savings_by_org = {}
+        top_recommendations_by_org = defaultdict(list)
+        for r in db.execute(
+            select(ranked_recs).where(ranked_recs.c.rn <= 5).order_by(ranked_recs.c.organization_id, ranked_recs.c.rn)
+        ):
+            total_savings_by_org[r.organization_id] = r.total_savings
+            top_recommendations_by_org[r.organization_id].append({
+                'title': r.title,
+                'savings': r.monthly_savings,
+                'risk': r.risk_level
+            })
+        
+        # Latest snapshot cost per organization in one query
+        ranked = select(
+            CostSnapshot.organization_id,
+            CostSnapshot.total_cost,
+            func.row_number().over(
+                partition_by=CostSnapshot.organization_id,
+                order_by=CostSnapshot.snapshot_date.desc()
+            ).label('rn')
+        ).where(CostSnapshot.organization_id.in_(org_ids)).subquery()
+        latest_costs = dict(db.execute(
+            select(ranked.c.organization_id, ranked.c.total_cost).where(ranked.c.rn == 1)
+        ).tuples())
         
         reports = []
         
         for org in orgs:
-            # Get active recommendations
-            recommendations = db.query(Recommendation).filter(
-                Recommendation.organization_id == org.id,
-                Recommendation.status == 'active'
-            ).all()
-            
-            # Calculate totals
-            total_savings = sum(r.monthly_savings for r in recommendations)
-            
-            # Get recent cost
-            latest_snapshot = db.query(CostSnapshot).filter(
-                CostSnapshot.organization_id == org.id
-            ).order_by(CostSnapshot.snapshot_date.desc()).first()
-            
-            current_spend = latest_snapshot.total_cost if latest_snapshot else 0
+            total_savings = total_savings_by_org.get(org.id, 0)
+            current_spend = latest_costs.get(org.id, 0)
             
             report = {
                 'organization': org.name,
                 'current_monthly_spend': current_spend,
                 'potential_savings': total_savings,
                 'savings_percentage': (total_savings / current_spend * 100) if current_spend > 0 else 0,
-                'top_recommendations': [
-                    {
-                        'title': r.title,
-                        'savings': r.monthly_savings,
-                        'risk': r.risk_level
-                    }
-                    for r in sorted(recommendations, key=lambda x: x.monthly_savings, reverse=True)[:5]
-                ],
+                'top_recommendations': top_recommendations_by_org[org.id],
                 'generated_at': datetime.utcnow().isoformat()
             }
             
@@ -258,3 +592,20 @@ def generate_optimization_report(organization_id: str = None):
     
     finally:
         db.close()
+
+
+@shared_task
+def update_last_login(user_id: str, login_time: str):
+    """Record a user's last login outside the login request"""
+    db = SessionLocal()
+    
+    try:
+        db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(last_login=datetime.fromisoformat(login_time))
+        )
+        db.commit()
+        
+    finally:
+        db.close()
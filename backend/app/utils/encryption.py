@@ -1,43 +1,92 @@
 """
 Encryption utilities for secure credential storage
 """
-from cryptography.fernet import Fernet
-import json
+from cryptography.fernet import Fernet, MultiFernet
+from functools import lru_cache
 import os
 from typing import Dict, Any
-from dotenv import load_dotenv
 
-load_dotenv()
+import orjson
 
-# Generate a key for development (in production, use AWS KMS or similar)
-def get_or_create_key():
-    """Get or create encryption key"""
-    key_file = ".encryption_key"
-    if os.path.exists(key_file):
+from app.config import settings
+
+KEY_FILE = ".encryption_key"
+
+def _load_or_create_key(key_file: str = KEY_FILE) -> bytes:
+    """
+    Read the development key file, generating it on first use.
+    
+    The new key is written to a private temp file and hard-linked into
+    place, which fails if another process won the race, so concurrent
+    workers always agree on one key and never read a half-written file.
+    """
+    try:
         with open(key_file, "rb") as f:
             return f.read()
-    else:
-        key = Fernet.generate_key()
-        with open(key_file, "wb") as f:
-            f.write(key)
-        # Add to .gitignore
-        with open("../.gitignore", "a") as f:
-            f.write("\n.encryption_key\n")
-        return key
-
-ENCRYPTION_KEY = get_or_create_key()
-cipher = Fernet(ENCRYPTION_KEY)
+    except FileNotFoundError:
+        pass
+    
+    tmp_file = f"{key_file}.{os.getpid()}.tmp"
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(Fernet.generate_key())
+    try:
+        os.link(tmp_file, key_file)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp_file)
+    
+    with open(key_file, "rb") as f:
+        return f.read()
+
+def _configured_keys() -> str:
+    """
+    Comma-separated Fernet keys, newest first.
+    
+    Read from the ENCRYPTION_KEY_SECRET_ID secret in AWS Secrets Manager
+    when set, else from ENCRYPTION_KEY; empty when neither is set.
+    """
+    if settings.encryption_key_secret_id:
+        import boto3  # Only needed for the Secrets Manager path
+        client = boto3.client("secretsmanager")
+        return client.get_secret_value(SecretId=settings.encryption_key_secret_id)["SecretString"]
+    return settings.encryption_key or ""
+
+@lru_cache(maxsize=1)
+def get_cipher() -> MultiFernet:
+    """
+    Credential cipher, built once per process on first use.
+    
+    Encrypts with the first configured key and decrypts with any of them,
+    so keys rotate by prepending a new one. Falls back to a local
+    development key file when no key is configured.
+    """
+    keys = [key.strip() for key in _configured_keys().split(",") if key.strip()]
+    if not keys:
+        return MultiFernet([Fernet(_load_or_create_key())])
+    return MultiFernet([Fernet(key.encode()) for key in keys])
 
 def encrypt_credentials(credentials: Dict[str, Any]) -> str:
     """Encrypt AWS credentials for storage"""
-    json_str = json.dumps(credentials)
-    encrypted = cipher.encrypt(json_str.encode())
+    encrypted = get_cipher().encrypt(orjson.dumps(credentials))
     return encrypted.decode()
 
+# Worker processes analyze the same accounts over and over; ciphertexts are
+# immutable (the keys are fixed per process), so each one is decrypted once
+@lru_cache(maxsize=1024)
+def _decrypt(encrypted: str) -> Dict[str, Any]:
+    decrypted = get_cipher().decrypt(encrypted.encode())
+    return orjson.loads(decrypted)
+
 def decrypt_credentials(encrypted: str) -> Dict[str, Any]:
     """Decrypt AWS credentials for use"""
-    decrypted = cipher.decrypt(encrypted.encode())
-    return json.loads(decrypted.decode())
+    # Copy so callers cannot mutate the cached value
+    return dict(_decrypt(encrypted))
+
+def rotate_credentials(encrypted: str) -> str:
+    """Re-encrypt stored credentials under the current primary key"""
+    return get_cipher().rotate(encrypted.encode()).decode()
 
 def test_encryption():
     """Test encryption/decryption"""
@@ -2,6 +2,8 @@
 Demo script to showcase the analyzer to beta users
 """
 import asyncio
+import heapq
+from operator import itemgetter
 from app.services.aws_cost_explorer import AWSCostExplorer
 from app.services.aws_ec2_analyzer import EC2Analyzer
 from app.services.aws_storage_analyzer import StorageAnalyzer
@@ -43,7 +45,7 @@ async def run_demo(access_key: str, secret_key: str):
         table.add_column("Service", style="cyan")
         table.add_column("Monthly Cost", style="green")
         
-        for service, cost in list(service_costs.items())[:5]:
+        for service, cost in heapq.nlargest(5, service_costs.items(), key=itemgetter(1)):
             table.add_row(service, f"${cost:,.2f}")
         
         console.print(table)
@@ -65,7 +67,8 @@ async def run_demo(access_key: str, secret_key: str):
     # Top Recommendations
     if opportunities:
         console.print("\n[bold]Top 3 Recommendations:[/bold]")
-        for i, opp in enumerate(opportunities[:3], 1):
+        top_opportunities = heapq.nlargest(3, opportunities, key=lambda o: o.get('monthly_savings', 0))
+        for i, opp in enumerate(top_opportunities, 1):
             console.print(f"\n  {i}. [yellow]{opp['reason']}[/yellow]")
             console.print(f"     Savings: [green]${opp.get('monthly_savings', 0):,.2f}/month[/green]")
             console.print(f"     Action: {opp['action']}")
@@ -1,4 +1,4 @@
 @echo off
 cd backend
 call venv\Scripts\activate
-celery -A app.celery_app worker --loglevel=info --pool=solo
+celery -A app.celery_app worker --loglevel=info --pool=solo -O fair -Q celery,io,cpu,transient
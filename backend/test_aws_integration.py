@@ -2,7 +2,9 @@
 Test AWS integration with your own account
 """
 import asyncio
+import heapq
 import os
+from operator import itemgetter
 from dotenv import load_dotenv
 
 from app.services.aws_cost_explorer import AWSCostExplorer
@@ -37,7 +39,7 @@ async def test_your_account():
     
     service_costs = cost_explorer.get_service_costs(30)
     print(f"   Services used: {len(service_costs)}")
-    for service, cost in list(service_costs.items())[:5]:
+    for service, cost in heapq.nlargest(5, service_costs.items(), key=itemgetter(1)):
         print(f"     - {service}: ${cost:.2f}")
     
     anomalies = cost_explorer.detect_cost_anomalies()
@@ -1,51 +1,292 @@
 """
-Test configuration using Supabase
+Test configuration
+
+Database tests run against TEST_DATABASE_URL when it is set, otherwise
+against a throwaway Postgres container started once per session with
+testcontainers (needs Docker). When neither is available they are skipped;
+they never fall back to the development DATABASE_URL, since they create
+tables and commit rows. The models rely on Postgres types (CITEXT, JSONB,
+UUID), so an in-memory SQLite database cannot host the schema.
+
+Importing the app still requires DATABASE_URL to be set (in the environment
+or .env), because app.database validates it at import. It only has to be
+reachable for tests that use the database.
 """
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import delete, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import hashlib
 import os
+from pathlib import Path
+from types import SimpleNamespace
 from dotenv import load_dotenv
 
+import app as app_package
 from app.main import app
-from app.database import Base, get_db
+from app.database import Base, get_db, to_async_url
+from app.models.base import Organization, User, UserRole
+from app.utils.auth import create_access_token, get_current_user, get_password_hash, pwd_context
+
+TEST_POSTGRES_IMAGE = "postgres:16-alpine"
+
+# pytest cache entry (under .pytest_cache) holding the OpenAPI schema
+OPENAPI_CACHE_KEY = "finops/openapi"
+
+# Set by pytest-xdist ("gw0", "gw1", ...); test emails carry it so parallel
+# workers sharing one database never insert or delete each other's rows
+WORKER_ID = os.getenv("PYTEST_XDIST_WORKER", "master")
+
+# Committed once per session and shared by every test that needs a login;
+# distinct from `test_user` so test_signup can still register that address
+SEEDED_USER = {
+    "email": f"test_{WORKER_ID}_seeded@example.com",
+    "password": "testpassword123",
+    "full_name": "Seeded User",
+    "organization_name": "Seeded Org"
+}
+
+# Emails are CITEXT columns; Alembic installs this extension in real deployments
+CREATE_CITEXT = text("CREATE EXTENSION IF NOT EXISTS citext")
+
+# A test holds one connection at a time (its outer transaction), so each
+# pytest process (or xdist worker) needs exactly one; capping it keeps
+# `-n auto` runs inside the Supabase connection quota. Recycle idle sockets
+# before the pooler drops them and fail fast if the database is unreachable
+TEST_POOL_OPTIONS = {
+    "pool_size": 1,
+    "max_overflow": 0,
+    "pool_recycle": 300,
+    "pool_pre_ping": True,
+    "connect_args": {"timeout": 5},
+}
+
+@pytest.fixture(scope="session", autouse=True)
+def fast_password_hashing():
+    """
+    Store passwords in plaintext for the whole run.
+
+    bcrypt is slow by design, and passlib 1.7's bcrypt backend fails its
+    self-test against bcrypt 5+. Tests only need hash/verify to round-trip.
+    """
+    original = pwd_context.to_dict()
+    pwd_context.update(schemes=["plaintext"])
+    yield
+    pwd_context.load(original)
+
+@pytest.fixture(scope="session")
+def client_nodb():
+    """
+    One TestClient (and event loop) for the whole run, with no database setup.
 
-load_dotenv()
+    Tests that never touch the database use it directly. The `with` block runs the app's startup/shutdown exactly once, and every
+    request in the session runs on the same loop, so pooled asyncpg
+    connections can be reused between tests.
+    """
+    with TestClient(app) as test_client:
+        yield test_client
 
-# Use Supabase for tests (same as development)
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
+def _app_sources_version() -> str:
+    """Fingerprint of the app package's source files (paths + mtimes)"""
+    digest = hashlib.sha256()
+    for path in sorted(Path(app_package.__file__).parent.rglob("*.py")):
+        digest.update(f"{path}:{path.stat().st_mtime_ns}".encode())
+    return digest.hexdigest()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+@pytest.fixture(scope="session")
+def openapi_snapshot(client_nodb, request):
+    """
+    The app's OpenAPI schema, for contract assertions.
 
-def override_get_db():
+    Kept in pytest's cache between runs and rebuilt only when a file under
+    app/ has changed since it was stored.
+    """
+    version = _app_sources_version()
+    cached = request.config.cache.get(OPENAPI_CACHE_KEY, None)
+    if cached and cached.get("version") == version:
+        return cached["schema"]
+
+    schema = client_nodb.get("/openapi.json").json()
+    request.config.cache.set(OPENAPI_CACHE_KEY, {"version": version, "schema": schema})
+    return schema
+
+@pytest.fixture(scope="session")
+def database_url():
+    """
+    URL of the database tests run against (see module docstring).
+
+    Resolved when the first database test starts, not at import, so
+    collection and database-free tests never connect to a database (the
+    app's settings still load .env and require DATABASE_URL to be set).
+    """
+    load_dotenv()
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+
+    try:
+        from testcontainers.postgres import PostgresContainer
+    except ImportError:
+        pytest.skip("set TEST_DATABASE_URL or install testcontainers to run database tests")
+
+    # Started once and removed when the session ends
+    postgres = PostgresContainer(TEST_POSTGRES_IMAGE)
     try:
-        db = TestingSessionLocal()
-        yield db
+        postgres.start()
+    except Exception as e:
+        pytest.skip(f"could not start a Postgres container: {str(e)}")
+
+    try:
+        yield postgres.get_connection_url()
     finally:
-        db.close()
+        postgres.stop()
+
+@pytest.fixture(scope="session")
+def test_engine(client_nodb, database_url):
+    """Async engine shared by all tests; disposed on the client's loop"""
+    engine = create_async_engine(to_async_url(database_url), **TEST_POOL_OPTIONS)
+    yield engine
+    client_nodb.portal.call(engine.dispose)
+
+@pytest.fixture(scope="session")
+def ensure_schema(test_engine):
+    """
+    Coroutine that creates any missing tables, once per session.
+
+    Run on a test's first database use rather than at session start, so
+    tests that never touch the database pass without one.
+    """
+    created = []
 
-app.dependency_overrides[get_db] = override_get_db
+    async def ensure():
+        if not created:
+            async with test_engine.begin() as conn:
+                await conn.execute(CREATE_CITEXT)
+                await conn.run_sync(Base.metadata.create_all)
+            created.append(True)
+
+    return ensure
 
 @pytest.fixture
-def client():
-    """Create test client"""
-    yield TestClient(app)
-    # Clean up test data after tests
-    db = TestingSessionLocal()
-    # Use text() wrapper for raw SQL
-    db.execute(text("DELETE FROM users WHERE email LIKE 'test%'"))
-    db.execute(text("DELETE FROM organizations WHERE email LIKE 'test%'"))
-    db.commit()
-    db.close()
+def client(client_nodb, test_engine, ensure_schema):
+    """
+    Test client whose requests all run inside one outer transaction.
+
+    Sessions join the connection with SAVEPOINTs, so route commits only
+    release a savepoint; the outer transaction is rolled back afterwards
+    and nothing a test writes is ever committed.
+    """
+    outer = {}
+
+    async def override_get_db():
+        # Opened on first use, on the client's event loop where requests run
+        if not outer:
+            await ensure_schema()
+            connection = await test_engine.connect()
+            outer.update(connection=connection, transaction=await connection.begin())
+        async with AsyncSession(
+            bind=outer["connection"],
+            join_transaction_mode="create_savepoint",
+            autoflush=False,
+            expire_on_commit=False
+        ) as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        yield client_nodb
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        if outer:
+            client_nodb.portal.call(outer["transaction"].rollback)
+            client_nodb.portal.call(outer["connection"].close)
+
+@pytest.fixture(scope="session")
+def seeded_user(client_nodb, test_engine, ensure_schema):
+    """
+    Admin user inserted directly, skipping the signup endpoint.
+
+    The password is hashed with the test hasher, so the user can still log
+    in through /auth/login. Removed again when the session ends.
+    """
+    email = SEEDED_USER["email"]
+
+    # One round-trip: the users DELETE runs as a CTE of the organizations
+    # one, and the foreign key is only checked once both are done
+    deleted_users = delete(User).where(User.email == email).cte("deleted_users")
+    remove_seeded = delete(Organization).where(Organization.email == email).add_cte(deleted_users)
+
+    async def remove():
+        async with test_engine.begin() as conn:
+            await conn.execute(remove_seeded)
+
+    async def seed():
+        await ensure_schema()
+        # Clear leftovers from an interrupted run
+        await remove()
+        async with AsyncSession(test_engine, expire_on_commit=False) as db:
+            org = Organization(name=SEEDED_USER["organization_name"], email=email)
+            db.add(org)
+            await db.flush()
+            user = User(
+                email=email,
+                hashed_password=get_password_hash(SEEDED_USER["password"]),
+                full_name=SEEDED_USER["full_name"],
+                organization_id=org.id,
+                role=UserRole.ADMIN
+            )
+            db.add(user)
+            await db.commit()
+        return user
+
+    yield client_nodb.portal.call(seed)
+    client_nodb.portal.call(remove)
+
+@pytest.fixture(scope="session")
+def auth_token(seeded_user):
+    """
+    Bearer token for the seeded user, issued once per session.
+
+    Signed the same way /auth/login signs it, so tests skip the login
+    request and its bcrypt check.
+    """
+    return create_access_token(data={"sub": seeded_user.email})
+
+class FakeSession:
+    """Stand-in AsyncSession whose scalar() lookups all return one object"""
+
+    def __init__(self, result):
+        self.result = result
+
+    async def scalar(self, *args, **kwargs):
+        return self.result
 
 @pytest.fixture
+def mock_account_db(client_nodb):
+    """
+    Client with no database behind it.
+
+    Every get_db lookup returns the same fake cloud account, and requests
+    are authenticated as a user of that account's organization.
+    """
+    account = SimpleNamespace(id="test-account-id", organization_id="test-org-id")
+    user = SimpleNamespace(email="test@example.com", organization_id=account.organization_id)
+
+    app.dependency_overrides[get_db] = lambda: FakeSession(account)
+    app.dependency_overrides[get_current_user] = lambda: user
+    try:
+        yield client_nodb
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        app.dependency_overrides.pop(get_current_user, None)
+
+@pytest.fixture(scope="session")
 def test_user():
-    """Create test user data"""
+    """Signup payload, built once; tests only read it"""
     return {
-        "email": "test@example.com",
+        "email": f"test_{WORKER_ID}@example.com",
         "password": "testpassword123",
         "full_name": "Test User",
         "organization_name": "Test Org"
-    }
\ No newline at end of file
+    }
@@ -1,22 +1,46 @@
 """
 API endpoint tests
 """
-def test_root(client):
+import bcrypt
+import pytest
+from passlib.context import CryptContext
+
+
+def _bcrypt_broken():
+    """passlib 1.7's bcrypt backend fails its self-test against bcrypt 5+"""
+    return int(bcrypt.__version__.split(".")[0]) >= 5
+
+def test_root(client_nodb):
     """Test root endpoint"""
-    response = client.get("/")
+    response = client_nodb.get("/")
     assert response.status_code == 200
     assert response.json()["message"] == "FinOps Little Analyzer API"
 
-def test_health(client):
+def test_health(client_nodb):
     """Test health check"""
-    response = client.get("/api/health")
+    response = client_nodb.get("/api/health")
     assert response.status_code == 200
     assert response.json()["status"] == "healthy"
 
+def test_openapi_routes(openapi_snapshot):
+    """Test the auth and analysis routes are published in the schema"""
+    paths = openapi_snapshot["paths"]
+    assert "post" in paths["/api/v1/auth/signup"]
+    assert "post" in paths["/api/v1/auth/login"]
+    assert "post" in paths["/api/v1/analysis/analyze"]
+
 def test_signup(client, test_user):
     """Test user signup"""
     response = client.post("/api/v1/auth/signup", json=test_user)
     assert response.status_code == 200
     data = response.json()
     assert data["email"] == test_user["email"]
-    assert data["role"] == "admin"
\ No newline at end of file
+    assert data["role"] == "admin"
+
+@pytest.mark.xfail(_bcrypt_broken(), strict=True, reason="passlib cannot load this bcrypt release")
+def test_password_hashing():
+    """Test the production bcrypt scheme (tests otherwise hash in plaintext)"""
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+    hashed = context.hash("testpassword123")
+    assert context.verify("testpassword123", hashed)
+    assert not context.verify("wrongpassword", hashed)
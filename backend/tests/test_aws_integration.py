@@ -1,34 +1,20 @@
 """
 Test AWS integration endpoints
 """
-import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch
+from unittest.mock import patch
+from moto import mock_aws
 
 from app.main import app
+from app.tasks import run_account_analysis
 
 
-@pytest.mark.skip(reason="bcrypt initialization issue in test environment")
-def test_connect_cloud_account(client, test_user):
+def test_connect_cloud_account(client, auth_token):
     """Test connecting AWS account"""
     
-    # Mock AWS connection test
-    with patch('app.services.aws_base.AWSService.test_connection') as mock_test:
-        mock_test.return_value = {
-            'connected': True,
-            'account_id': '123456789012',
-            'permissions': {'ec2:DescribeInstances': True}
-        }
-        
-        # First login
-        client.post("/api/v1/auth/signup", json=test_user)
-        login_response = client.post("/api/v1/auth/login", data={
-            "username": test_user["email"],
-            "password": test_user["password"]
-        })
-        token = login_response.json()["access_token"]
-        
-        # Connect account
+    # The real connection test runs against moto's in-memory AWS, whose
+    # STS reports the default account 123456789012 for any credentials
+    with mock_aws():
         response = client.post(
             "/api/v1/cloud-accounts/connect",
             json={
@@ -38,7 +24,7 @@ def test_connect_cloud_account(client, test_user):
                 "secret_key": "wJalrXUtnFEMI/K7MDENG/bPxRfiCYEXAMPLEKEY",
                 "region": "us-east-1"
             },
-            headers={"Authorization": f"Bearer {token}"}
+            headers={"Authorization": f"Bearer {auth_token}"}
         )
         
         assert response.status_code == 200
@@ -47,34 +33,34 @@ def test_connect_cloud_account(client, test_user):
         assert data["provider"] == "aws"
 
 
-@pytest.mark.skip(reason="bcrypt initialization issue in test environment")
-def test_run_analysis(client, test_user):
+def test_run_analysis(mock_account_db):
     """Test running analysis"""
     
-    # Setup
-    client.post("/api/v1/auth/signup", json=test_user)
-    login_response = client.post("/api/v1/auth/login", data={
-        "username": test_user["email"],
-        "password": test_user["password"]
-    })
-    token = login_response.json()["access_token"]
-    
-    # Mock cloud account exists
-    with patch('app.routers.analysis.db') as mock_db:
-        mock_account = Mock()
-        mock_account.id = "test-account-id"
-        mock_account.organization_id = "test-org-id"
-        mock_db.query().filter().first.return_value = mock_account
+    # Queue the task without a Celery broker
+    with patch('app.routers.analysis.run_account_analysis') as mock_task:
+        mock_task.name = run_account_analysis.name
+        mock_task.delay.return_value.id = "test-task-id"
         
-        response = client.post(
+        response = mock_account_db.post(
             "/api/v1/analysis/analyze",
             json={
                 "cloud_account_id": "test-account-id",
                 "analysis_types": ["cost", "ec2"]
-            },
-            headers={"Authorization": f"Bearer {token}"}
+            }
         )
         
         assert response.status_code == 200
         data = response.json()
         assert data["status"] == "started"
+        assert data["analysis_id"] == "test-task-id"
+        mock_task.delay.assert_called_once_with("test-account-id", ["cost", "ec2"])
+
+
+def test_analysis_status_hidden_from_other_orgs(mock_account_db):
+    """Test another organization's analysis is reported as not found"""
+    
+    owner = {"org_id": "other-org-id", "task": run_account_analysis.name}
+    with patch('app.routers.analysis.get_json_sync', return_value=owner):
+        response = mock_account_db.get("/api/v1/analysis/analyze/test-task-id")
+    
+    assert response.status_code == 404